@@ -0,0 +1,186 @@
+from pyspark.sql import functions as F
+from pyspark.sql.window import Window
+import pandas as pd
+
+from queries import as_keywords
+
+# %% [markdown]
+# agregar as palavras-chave das noticias filtradas
+
+# %%
+
+def keyword_cube(df_with_query, by=()):
+    # one scan + one shuffle: (keyword, month, source) cells that every
+    # statistic of the search is derived from (per group of columns in by)
+    return (
+        df_with_query
+        .select(F.explode("keywords").alias("key", "value"),
+                "timestamp",
+                F.coalesce(F.col("source"), F.lit("null")).alias("source"),
+                "archive",
+                "sentiment",
+                *by)
+        .groupBy(*by, "key", "timestamp", "source")
+        .agg(F.sum("value").alias("mentions"),
+             F.count(F.lit(1)).alias("news_count"),
+             F.sum(F.col("sentiment") * F.col("value")).alias("sentiment_sum"),
+             F.collect_list("archive").alias("news"))
+    )
+
+def keywords_from_cube(cube, min_count=5, top_n=None, exclude=None, keys=None):
+    # totals and weighted sentiment per keyword (small: one row per keyword)
+    totals = (
+        cube
+        .groupBy("key")
+        .agg(F.sum("mentions").alias("count"),
+             F.sum("sentiment_sum").alias("sentiment_sum"))
+        .filter(F.col("count") >= min_count)
+    )
+    if exclude is not None:
+        totals = totals.filter(~F.col("key").isin(as_keywords(exclude)))
+
+    # keep only the top_n keywords before gathering their details,
+    # so the driver never receives the whole keyword space
+    # (or only the keys already chosen, e.g. by the cooccurrence matrix)
+    top_cube = cube
+    if keys is not None:
+        totals = totals.filter(F.col("key").isin(list(keys)))
+        top_cube = cube.filter(F.col("key").isin(list(keys)))
+    elif top_n is not None:
+        totals = totals.orderBy(F.desc("count")).limit(top_n)
+        top_cube = cube.join(F.broadcast(totals.select("key")), on="key")
+
+    # news urls per keyword
+    news = (
+        top_cube
+        .groupBy("key")
+        .agg(F.flatten(F.collect_list("news")).alias("news"))
+    )
+
+    # mentions per month
+    by_date = (
+        top_cube
+        .groupBy("key", "timestamp")
+        .agg(F.sum("mentions").alias("mentions"))
+        .groupBy("key")
+        .agg(F.map_from_entries(F.collect_list(F.struct("timestamp", "mentions"))).alias("date"))
+    )
+
+    # news per source
+    by_source = (
+        top_cube
+        .groupBy("key", "source")
+        .agg(F.sum("news_count").alias("news_count"))
+        .groupBy("key")
+        .agg(F.map_from_entries(F.collect_list(F.struct("source", "news_count"))).alias("source"))
+    )
+
+    result = (
+        totals
+        .join(news, on="key")
+        .join(by_date, on="key")
+        .join(by_source, on="key")
+        .collect()
+    )
+
+    # same schema as the json cache
+    return {row["key"]: {"count": row["count"],
+                         "date": row["date"],
+                         "sentiment": row["sentiment_sum"]/row["count"],
+                         "source": row["source"],
+                         "news": row["news"]} for row in result}
+
+def sentiment_quantiles(cube, min_count=5, exclude=None):
+    # quantiles of the keyword sentiments used to colour the graph
+    totals = (
+        cube
+        .groupBy("key")
+        .agg((F.sum("sentiment_sum")/F.sum("mentions")).alias("sentiment"),
+             F.sum("mentions").alias("count"))
+        .filter(F.col("count") >= min_count)
+    )
+    if exclude is not None:
+        totals = totals.filter(~F.col("key").isin(as_keywords(exclude)))
+
+    row = totals.agg(F.expr("percentile(sentiment, array(0.1, 0.3, 0.7, 0.9))").alias("q")).collect()[0]
+    if row["q"] is None:
+        return None
+    return dict(zip(["q10", "q30", "q70", "q90"], row["q"]))
+
+def keyword_aggregation(df_with_query, min_count=5):
+    return keywords_from_cube(keyword_cube(df_with_query), min_count)
+
+def keyword_detail(df_with_query, topic, min_count=5):
+    # a single keyword's aggregate, for topics outside the top_n
+    cube = keyword_cube(df_with_query.filter(F.col("keywords").getItem(topic).isNotNull()))
+    return keywords_from_cube(cube.filter(F.col("key") == topic), min_count).get(topic)
+
+# %% [markdown]
+# perfil completo da pesquisa a partir de um unico scan
+
+# %%
+
+def top_keywords_by_month(cube, query, top=5):
+    ranking = Window.partitionBy("timestamp").orderBy(F.desc("key_mentions"))
+    return (
+        cube
+        .filter(~F.col("key").isin(as_keywords(query)))
+        .groupBy("timestamp", "key")
+        .agg(F.sum("mentions").alias("key_mentions"))
+        .withColumn("rank", F.row_number().over(ranking))
+        .filter(F.col("rank") <= top)
+        .groupBy("timestamp")
+        .agg(F.expr("transform(array_sort(collect_list(struct(rank, key))), x -> x.key)").alias("top5_keywords"))
+        .toPandas()
+    )
+
+def news_cells(df_with_query):
+    # article counts per month and per source
+    return pd.DataFrame(
+        df_with_query
+        .groupBy("timestamp", F.coalesce(F.col("source"), F.lit("null")).alias("source"))
+        .agg(F.count(F.lit(1)).alias("news_count"))
+        .collect(),
+        columns=["timestamp", "source", "news_count"]
+    )
+
+def profile_from_cube(cube, query, with_keywords=True, top_n=200, keys=None, all_sentiments=None,
+                      query_cells=None):
+    # query: a keyword, or the keywords of a multi-topic query (left out of
+    # the related keywords); for a single keyword every matched article
+    # mentions it, so its cells hold the article counts per month and per source
+    if query_cells is None:
+        query_cells = pd.DataFrame(
+            cube.filter(F.col("key") == query).select("timestamp", "source", "news_count").collect(),
+            columns=["timestamp", "source", "news_count"]
+        )
+
+    profile = {"amount_of_news": int(query_cells["news_count"].sum())}
+    if profile["amount_of_news"] == 0:
+        return profile
+
+    profile["first_news"] = int(query_cells["timestamp"].min())
+    profile["sources"] = (
+        query_cells.groupby("source", as_index=False)["news_count"].sum()
+        .rename(columns={"news_count": "count"})
+    )
+    profile["news_by_month"] = (
+        query_cells.groupby("timestamp", as_index=False)["news_count"].sum()
+        .rename(columns={"news_count": "count_of_news"})
+    )
+    profile["keywords_by_month"] = top_keywords_by_month(cube, query)
+    if with_keywords:
+        profile["keywords"] = keywords_from_cube(cube, top_n=top_n, exclude=query, keys=keys)
+        profile["all_sentiments"] = (all_sentiments if all_sentiments is not None
+                                     else sentiment_quantiles(cube, exclude=query))
+
+    return profile
+
+def query_profile(df_with_query, query, with_keywords=True, top_n=200, keys=None, all_sentiments=None):
+    # multi-topic queries count their articles directly
+    query_cells = None if isinstance(query, str) else news_cells(df_with_query)
+
+    cube = keyword_cube(df_with_query).cache()
+    profile = profile_from_cube(cube, query, with_keywords, top_n, keys, all_sentiments, query_cells)
+    cube.unpersist()
+    return profile
@@ -1,21 +1,29 @@
 # Flask
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO
-
-# Spark
-from pyspark.sql import SparkSession
-from pyspark.sql import functions as F
-from pyspark.sql.types import *
+from flask import Flask, render_template, request, session, jsonify, make_response
+from flask_socketio import SocketIO, emit, join_room
 
 # Others
 import time
 import os
-import hashlib
-import json
 import random
+import hmac
+from collections import ChainMap, deque
 
 # Local
-from graph import create_keyword_graph
+from paths import NEWS_PATH, PARQUET_PATH
+from manifest import read_manifest, updated_keywords
+from engine import make_engine
+from store import ResultStore, normalize_query
+from jobs import SearchJobs, Cancelled
+from approx import stratified_sample, scale_profile
+from cache import QueryCache, cache_fingerprint
+from cooccurrence import load_cooccurrence
+from vocabulary import Vocabulary, fold
+from queries import parse, resolve, to_text, evaluate, positive_terms, keywords_of, can_match
+from queries import parse_window, with_window, split_window
+from keywordtable import KeywordTable
+from graph import create_keyword_graph, node_detail, expand_graph, GRAPH_NODES, GRAPH_MORE
+from assets import PLOTLY_JS, PLOTLY_JS_URL, IMMUTABLE, write_plotly_js
 from info import pie_newsSources, timeseries_news, topic_wordcloud
 from info2 import ts_topicrelation, sources_topicrelation, news_topicrelation
 
@@ -27,191 +35,653 @@ from info2 import ts_topicrelation, sources_topicrelation, news_topicrelation
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
-# Initialize SparkSession
-spark = SparkSession.builder \
-    .appName("News App") \
-    .config("spark.ui.enabled", "false") \
-    .getOrCreate()
-
-# Define the data schema
-schema = StructType([
-    StructField("timestamp", IntegerType(), True),
-    StructField("source", StringType(), True),
-    StructField("archive", StringType(), True),
-    StructField("id", IntegerType(), True),
-    StructField("probability", FloatType(), True),
-    StructField("keywords", MapType(StringType(), IntegerType()), True),
-    StructField("sentiment", FloatType(), True)
-])
-df = spark.read.format("json").schema(schema).load("../data/news/status=success")
-
-globalVar = {
-            "search_done": False,
-            "zero_results": True,
-            "topicrelation": False,
-            "total_amount_of_news": df.count(), # substituir por contagem "manual"
-            "first_news": 1998,
-            "last_news": str(df.agg(F.max("timestamp")).collect()[0][0]), # substituir por ano à mão
-            }
+# Conversion manifest (corpus stats and incremental updates), if there is one
+manifest = read_manifest(PARQUET_PATH)
+
+def load_data(manifest, previous=None):
+    # query engine, corpus stats, cooccurrence matrix and vocabulary,
+    # loaded again whenever new articles are ingested (the previous engine
+    # only adds the new files)
+    global engine, corpusVar, cooccurrence, vocabulary
+
+    # Query engine (LUPA_ENGINE: spark, or arrow for small deployments without a JVM)
+    new_engine = make_engine() if previous is None else previous.updated()
+    if manifest is not None:
+        total_amount_of_news, last_news = manifest["news"], manifest["last_news"]
+    else:
+        total_amount_of_news, last_news = new_engine.corpus_stats()
+
+    new_corpusVar = {
+                "total_amount_of_news": total_amount_of_news, # substituir por contagem "manual"
+                "first_news": 1998,
+                "last_news": str(last_news), # substituir por ano à mão
+                }
+
+    # Keyword cooccurrence matrix (memory mapped), if it was built
+    new_cooccurrence = load_cooccurrence()
+
+    # Keyword prefix index, for suggestions and to resolve queries to keywords
+    if new_cooccurrence is not None:
+        new_vocabulary = Vocabulary(new_cooccurrence.keywords, new_cooccurrence.doc_freq)
+    else:
+        new_vocabulary = Vocabulary(*new_engine.keywords())
+
+    engine, corpusVar, cooccurrence, vocabulary = new_engine, new_corpusVar, new_cooccurrence, new_vocabulary
+
+load_data(manifest)
+
+# Every rendered artifact of a search, valid for this dataset and code version
+query_cache = QueryCache("cache", cache_fingerprint(NEWS_PATH, PARQUET_PATH),
+                         max_bytes=int(os.environ.get("CACHE_MB", 2048)) * 2**20,
+                         policy=os.environ.get("CACHE_POLICY", "lru"))
+
+# Search results shared by every session, keyed by normalized query
+results = ResultStore(max_bytes=int(os.environ.get("RESULT_STORE_MB", 512)) * 2**20)
+
+# Related keywords kept with a search's result
+RESULT_KEYWORDS = 200
+
+# Topics with more matched news than this are first answered from a sample
+approx_threshold = int(os.environ.get("APPROX_NEWS", 20000))
+approx_sample = int(os.environ.get("APPROX_SAMPLE", 5000))
+
+# Larger graphs (/grafo?nos=2000, drawn with WebGL) and their documents,
+# kept apart from the search results; neighborhoods are aggregated (as
+# background jobs) at one of these sizes, any smaller graph is a prefix
+graph_max_nodes = int(os.environ.get("GRAPH_MAX_NODES", 2000))
+neighborhood_sizes = sorted({size for size in (500, 2000) if size < graph_max_nodes} | {graph_max_nodes})
+graph_sizes = sorted({GRAPH_NODES, *neighborhood_sizes})
+neighborhoods = ResultStore(max_bytes=int(os.environ.get("GRAPH_STORE_MB", 256)) * 2**20)
+graph_documents = ResultStore(max_bytes=int(os.environ.get("GRAPH_STORE_MB", 256)) * 2**20)
+
+# Seconds between checks for newly ingested articles (0: never)
+ingest_poll = int(os.environ.get("INGEST_POLL", 60))
+
+# Token of the /admin routes (sent as "Authorization: Bearer <token>"),
+# they are closed when it is not set
+admin_token = os.environ.get("ADMIN_TOKEN", "")
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+app.secret_key = os.environ.get("SECRET_KEY", os.urandom(24))
+socketio = SocketIO(app, async_mode="threading")
+
+# plotly.js is loaded once from static/ by every page and graph
+write_plotly_js(app.static_folder)
+app.jinja_env.globals["plotly_js"] = PLOTLY_JS
+
+@app.after_request
+def cache_assets(response):
+    if request.path == PLOTLY_JS_URL and response.status_code == 200:
+        response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+def session_view():
+    # template variables for the search this session is looking at
+    # (reloaded from the query cache if the store evicted it)
+    query = session.get("query")
+    result = find_result(query) if query else None
+    if result is None:
+        return {**corpusVar,
+                "search_done": False,
+                "zero_results": True,
+                "topicrelation": False}
+
+    return {**corpusVar, **result,
+            "search_done": True,
+            "topicrelation": False}
 
 @app.route('/')
 def home():
-    return render_template('index.html', globalVar=globalVar)
+    return render_template('index.html', globalVar=session_view())
 
 @app.route('/sobre')
 def sobre():
-    global globalVar
-    if globalVar["search_done"] == False:
-        return render_template('404.html', globalVar=globalVar)
-    
-    return render_template('info.html', globalVar=globalVar)
+    view = session_view()
+    if view["search_done"] == False:
+        return render_template('404.html', globalVar=view)
+
+    return render_template('info.html', globalVar=view)
 
 @app.route('/grafo')
 def grafo():
-    global globalVar
-    if globalVar["search_done"] == False or globalVar["zero_results"] == True:
-        return render_template('404.html', globalVar=globalVar)
+    view = session_view()
+    if view["search_done"] == False or view["zero_results"] == True:
+        return render_template('404.html', globalVar=view)
+
+    view["graph_nodes"], view["graph_edges"] = graph_options()
 
-    return render_template('graph.html', globalVar=globalVar)
+    # choices of the graph's size (above GRAPH_NODES it is drawn with WebGL)
+    view["graph_sizes"], view["graph_webgl_above"] = graph_sizes, GRAPH_NODES
+    return render_template('graph.html', globalVar=view)
 
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
-@app.route('/pesquisa', methods=['GET'])
-def pesquisa():
-    global globalVar
-    globalVar["search_done"] = True
-    globalVar["zero_results"] = False
-    globalVar["topicrelation"] = False
-
-    # query requested
-    query = request.args.get('topico', '')
-    globalVar['query'] = query
-
-    # data filtering
-    query_col_counts = F.col("keywords").getItem(query)
-    df_with_q = df.filter(query_col_counts.isNotNull() & (query_col_counts > 4)).cache()
-    globalVar['query_amountofnews'] = df_with_q.count()
+def is_keyword(query):
+    return vocabulary.canonical(query) is not None
+
+def query_tree(query):
+    # a keyword, or a boolean expression over keywords ("A AND NOT B");
+    # corpus keywords that look like one ("Banco de Portugal, SA") and
+    # malformed expressions are looked up as a plain keyword
+    if is_keyword(query):
+        return query
+    try:
+        return parse(query)
+    except ValueError:
+        return query
+
+def matched_news(query, window=None):
+    # sorted row ids of the matched news, and the keywords they are about
+    tree = query_tree(query)
+    if isinstance(tree, str):
+        return engine.lookup(tree, window=window), tree
+    return evaluate(tree, lambda term: engine.lookup(term, window=window)), positive_terms(tree)
+
+def search_profile(key, progress=lambda stage: None, approximate=True, top_n=RESULT_KEYWORDS):
+    # profile of the news matching a search, with its top_n related keywords
+    query, window = split_window(key)
+
+    # the cooccurrence matrix answers unknown topics, the related keywords
+    # and their sentiment without Spark (single keyword queries over the
+    # whole archive only)
+    keys, all_sentiments = None, None
+    if cooccurrence is not None and isinstance(query_tree(query), str) and window is None:
+        if cooccurrence.news_count(query) == 0:
+            return {"amount_of_news": 0}
+        keys = cooccurrence.top(query, top_n)
+        all_sentiments = cooccurrence.sentiment_quantiles(query)
+
+    # data filtering (posting list set operations) and exploration
+    # (single pass over the matched news)
+    progress("filtragem")
+    row_ids, keywords = matched_news(query, window)
+    progress("agregacao")
+
+    # broad topics: a stratified sample first, the exact result follows
+    if approximate and len(row_ids) > approx_threshold:
+        sample, strata = stratified_sample(row_ids, engine.months(row_ids, window), approx_sample)
+        profile = engine.profile(sample, keywords, top_n, keys=keys, all_sentiments=all_sentiments, window=window)
+        return scale_profile(profile, strata)
+
+    return engine.profile(row_ids, keywords, top_n, keys=keys, all_sentiments=all_sentiments, window=window)
+
+def run_search(key, progress=lambda stage: None, approximate=True):
+    return build_result(key, search_profile(key, progress, approximate), progress)
+
+def build_result(query, profile, progress=lambda stage: None):
+    # render every artifact of a search from its profile
+    result = {"query": query, "zero_results": False}
+    result['query_amountofnews'] = profile["amount_of_news"]
 
     # more then 0 news with the query?
-    if globalVar['query_amountofnews'] == 0:
-        globalVar['keywords'] = {}
-        globalVar["zero_results"] = True
-        globalVar["wordcloud"] = topic_wordcloud({},
-                                                query, "static/Roboto-Black.ttf")
-
-        # render the index page
-        return render_template('info.html', globalVar=globalVar)
-    
-    # data exploration
-    query_firstnews = str(df_with_q.agg(F.min("timestamp")).collect()[0][0])
+    if result['query_amountofnews'] == 0:
+        result['keywords'] = {}
+        result["zero_results"] = True
+        result["wordcloud"] = topic_wordcloud({},
+                                              query, "static/Roboto-Black.ttf")
+        return result
+
+    query_firstnews = str(profile["first_news"])
     meses = {
         "01": "janeiro", "02": "fevereiro", "03": "março", "04": "abril",
         "05": "maio", "06": "junho", "07": "julho", "08": "agosto",
         "09": "setembro", "10": "outubro", "11": "novembro", "12": "dezembro"}
-    globalVar["query_firstnews"] = f"{meses[query_firstnews[4:]]} de {query_firstnews[:4]}"
-
-    # query already processed?
-    hashed_query = hashlib.sha256(query.encode()).hexdigest()[:10]
-    if os.path.exists(f"cache/{hashed_query}.json"):
-        
-        with open(f"cache/{hashed_query}.json", 'r') as json_file:
-            globalVar['keywords'] = json.load(json_file)
-    
-    else:
-        # process the news if not processed yet
-        result = (
-            df_with_q.rdd
-            .flatMap(lambda row: [
-                (key, (value,
-                    {row["timestamp"]: value},
-                    row["sentiment"]*value,
-                    {row["source"]: 1},
-                    [row["archive"]])) for key, value in row["keywords"].items()
-            ])
-            .reduceByKey(lambda a, b: (
-                a[0] + b[0],  # Sum count values
-                {ts: a[1].get(ts, 0) + b[1].get(ts, 0) for ts in set(a[1]) | set(b[1])},  # Merge timestamp counts
-                a[2] + b[2],  # Sum sentiment values
-                {source: a[3].get(source, 0) + b[3].get(source, 0) for source in set(a[3]) | set(b[3])},  # Merge source counts
-                a[4] + b[4]  # Merge archive lists
-            ))
-            .collect()
-        )
-        # change data schema
-        globalVar['keywords'] = {key: {"count": value[0],
-                        "date": value[1],
-                        "sentiment": value[2]/value[0],
-                        "source": value[3],
-                        "news": value[4]} for key, value in result}
-        globalVar['keywords'] = {k: v for k, v in globalVar['keywords'].items() if v["count"] >= 5}
-
-        # save in cache
-        with open(f"cache/{hashed_query}.json", 'w') as json_file:
-            json.dump(globalVar['keywords'], json_file)
-    
-
-    # create graph src code
-    globalVar["graph_html"] = create_keyword_graph(globalVar['keywords'], 125, query)
+    result["query_firstnews"] = f"{meses[query_firstnews[4:]]} de {query_firstnews[:4]}"
+
+    # only the top keywords are collected, the rest is served by /relacao
+    result['keywords'] = KeywordTable.from_keywords(profile["keywords"])
+    result['all_sentiments'] = profile["all_sentiments"]
+    if "approximate" in profile:
+        result["approximate"] = profile["approximate"]
+
+    # create graph src code (node positions are kept with the result)
+    progress("grafo")
+    result["layout"] = {}
+    result["graph_html"] = create_keyword_graph(result['keywords'], GRAPH_NODES, query,
+                                                result['all_sentiments'], result["layout"])
 
     # create pie plot from news sources
-    globalVar["pie_sources"] = pie_newsSources(df_with_q) 
+    progress("graficos")
+    result["pie_sources"] = pie_newsSources(profile["sources"])
 
     # create ts plot from news
-    globalVar["ts_news"], globalVar["news_by_month"] = timeseries_news(df_with_q, query)
+    result["ts_news"], result["news_by_month"] = timeseries_news(profile["news_by_month"],
+                                                                 profile["keywords_by_month"])
 
     # create wordcloud
-    globalVar["wordcloud"] = topic_wordcloud({k: v["count"] for k,v in globalVar['keywords'].items()},
-                                                query, "static/Roboto-Black.ttf")
-    
-    # disable topic relation
-    globalVar["topicrelation"] = False
+    progress("wordcloud")
+    result["wordcloud"] = topic_wordcloud(dict(zip(result['keywords'], result['keywords'].counts.tolist())),
+                                          query, "static/Roboto-Black.ttf")
+
+    return result
+
+def graph_room(key, size):
+    # socket room (and loading page id) of a neighborhood's job
+    return f"{key} #{size}"
+
+def neighborhood_of_room(room):
+    # (query, size) of a graph_room, None for a search's own room
+    key, _, size = room.rpartition(" #")
+    return (key, int(size)) if key and size.isdigit() else None
+
+def search_progress(query, stage):
+    if isinstance(query, tuple):
+        query = graph_room(*query)
+    socketio.emit("progresso", {"topico": query, "etapa": stage}, to=query)
+
+def search_done(query, result):
+    # neighborhoods of larger graphs (jobs keyed by (query, size))
+    if isinstance(query, tuple):
+        neighborhoods.put(query, result)
+        socketio.emit("concluido", {"topico": graph_room(*query), "aproximado": False}, to=graph_room(*query))
+        return
+
+    results.put(query, result)
+
+    # larger graphs of an earlier (approximate) result are redone on demand
+    neighborhoods.discard_if(lambda key: key[0] == query)
+    graph_documents.discard_if(lambda key: key[0] == query)
+    socketio.emit("concluido", {"topico": query, "aproximado": "approximate" in result}, to=query)
+
+    # only exact results are kept on disk, approximate ones get refined
+    if "approximate" in result:
+        refine(query)
+    else:
+        query_cache.put(query, result)
+
+def search_error(query, error):
+    if isinstance(query, tuple):
+        query = graph_room(*query)
+    socketio.emit("erro", {"topico": query}, to=query)
+
+# Searches run in the background, one job per topic at a time
+jobs = SearchJobs(max_workers=int(os.environ.get("SEARCH_WORKERS", 2)),
+                  on_progress=search_progress,
+                  on_done=search_done,
+                  on_error=search_error)
+
+# Exact results of approximate searches, dropped when nobody is following
+followed = {}
+
+def watched(query, grace=30):
+    # someone on the topic's room now, or a moment ago (between pages)
+    if any(True for _ in socketio.server.manager.get_participants("/", query)):
+        followed[query] = time.time()
+    return time.time() - followed.get(query, 0) < grace
+
+def refine_progress(query, stage):
+    if not watched(query):
+        raise Cancelled(query)
+
+exact_jobs = SearchJobs(max_workers=1,
+                        on_progress=refine_progress,
+                        on_done=search_done,
+                        on_error=search_error)
+
+def refine(query):
+    exact_jobs.submit(query, lambda progress: run_search(query, progress, approximate=False))
+
+# Cache warm-ups, one at a time, writing straight to the query cache;
+# the last failures are logged and reported by the /admin routes
+batch_failures = deque(maxlen=20)
+
+def batch_error(key, error):
+    app.logger.error("cache warm-up %s failed: %r", key, error)
+    batch_failures.append({"tarefa": key, "erro": repr(error), "quando": time.time()})
+
+batch_jobs = SearchJobs(max_workers=1,
+                        on_progress=lambda key, stage: None,
+                        on_done=lambda key, computed: None,
+                        on_error=batch_error)
+
+@socketio.on("acompanhar")
+def acompanhar(data):
+    # follow the progress of a topic's search
+    query = normalize_query(data.get("topico", ""))
+    join_room(query)
+    followed[query] = time.time()
+
+    # finished before the page connected?
+    result = results.get(query)
+    if result is not None:
+        emit("concluido", {"topico": query, "aproximado": "approximate" in result})
+    elif neighborhood_of_room(query) in neighborhoods:
+        emit("concluido", {"topico": query, "aproximado": False})
+
+def find_result(key):
+    # searched before (by this or any other session, or any earlier run)?
+    result = results.get(key)
+    if result is None:
+        result = query_cache.get(key)
+        if result is not None:
+            results.put(key, result)
+    return result
+
+def request_window():
+    # optional month bounds (?de=2019&ate=2019-06), malformed ones are ignored
+    try:
+        return parse_window(request.args.get('de', ''), request.args.get('ate', ''))
+    except ValueError:
+        return None
+
+def open_search(key):
+    # the search's page if it is done, otherwise search in the background
+    # and follow its progress (the loading page reloads this same url)
+    session["query"] = key
+    result = find_result(key)
+    if result is None:
+        jobs.submit(key, lambda progress: run_search(key, progress))
+        return render_template('loading.html', globalVar={**corpusVar, "query": key})
+
+    # an approximate result whose refinement was dropped? refine it again
+    if "approximate" in result:
+        refine(key)
+    return None
+
+@app.route('/pesquisa', methods=['GET'])
+def pesquisa():
+    # query requested
+    query = normalize_query(request.args.get('topico', ''))
+    window = request_window()
+
+    # "LISBOA" and "lisboa" are the corpus keyword "Lisboa"; topics that are
+    # not in the vocabulary have no news, no need to search them (nor a
+    # boolean query that needs one of them, or only has such topics)
+    tree = query_tree(query)
+    if isinstance(tree, str):
+        topic = vocabulary.canonical(tree)
+        if topic is None:
+            key = with_window(query, window)
+            results.put(key, build_result(key, {"amount_of_news": 0}))
+        else:
+            query = topic
+    else:
+        tree = resolve(tree, vocabulary.canonical)
+        query = to_text(tree)
+        if not can_match(tree, lambda term: vocabulary.canonical(term) is not None):
+            key = with_window(query, window)
+            results.put(key, build_result(key, {"amount_of_news": 0}))
+
+    # the time window is part of the search (and of its cache key)
+    loading = open_search(with_window(query, window))
+    if loading is not None:
+        return loading
 
     # render the graph page
-    return render_template('info.html', globalVar=globalVar)
+    return render_template('info.html', globalVar=session_view())
 
 
 @app.route('/relacao', methods=['GET'])
 def relacao():
-    global globalVar
-    if globalVar["search_done"] == False or globalVar["zero_results"] == True:
-        return render_template('404.html', globalVar=globalVar)
-    globalVar["topicrelation"] = True
+    # a time window switches to that window's search of the same query
+    window = request_window()
+    if window is not None and "query" in session:
+        loading = open_search(with_window(split_window(session["query"])[0], window))
+        if loading is not None:
+            return loading
+
+    view = session_view()
+    if view["search_done"] == False or view["zero_results"] == True:
+        return render_template('404.html', globalVar=view)
+    view["topicrelation"] = True
 
     # topic relation requested
-    related_topic = request.args.get('entre', '')
-    globalVar['related_topic'] = related_topic
-    
-    globalVar["topicrelation_exists"] = related_topic in globalVar['keywords']
+    related_topic = normalize_query(request.args.get('entre', ''))
+    related_topic = vocabulary.canonical(related_topic) or related_topic
+    view['related_topic'] = related_topic
+
+    # topics outside the top keywords are aggregated on demand
+    # (kept in this request only, the stored result is shared)
+    keywords = view['keywords']
+    query, window = split_window(view['query'])
+    tree = query_tree(query)
+    known_pair = (cooccurrence is None or not isinstance(tree, str) or window is not None
+                  or (cooccurrence.pair(query, related_topic) or (0,))[0] >= 5)
+    if related_topic not in keywords and related_topic not in positive_terms(tree) and known_pair:
+        detail = engine.keyword_detail(matched_news(query, window)[0], related_topic, window=window)
+        if detail is not None:
+            keywords = ChainMap({related_topic: detail}, keywords)
+
+    view["topicrelation_exists"] = related_topic in keywords
 
 
     # return results
-    if globalVar["topicrelation_exists"]:
-        globalVar["count_topicrelation"] = globalVar['keywords'][related_topic]["count"]
-        globalVar["sentiment_topicrelation"] = globalVar['keywords'][related_topic]["sentiment"]
-        globalVar["ts_topicrelation"] = ts_topicrelation(globalVar["news_by_month"], globalVar['keywords'], related_topic, globalVar['query'])
-        globalVar["sources_topicrelation"] = sources_topicrelation(globalVar['keywords'], related_topic)
-        globalVar["news_topicrelation"] = news_topicrelation(globalVar['keywords'], related_topic)
-    
+    if view["topicrelation_exists"]:
+        topic = KeywordTable.from_keywords({related_topic: keywords[related_topic]})
+        view["count_topicrelation"] = int(topic.counts[0])
+        view["sentiment_topicrelation"] = float(topic.sentiments[0])
+        view["ts_topicrelation"] = ts_topicrelation(view["news_by_month"], topic, related_topic, view['query'])
+        view["sources_topicrelation"] = sources_topicrelation(topic, related_topic)
+        view["news_topicrelation"] = news_topicrelation(topic, related_topic)
+
     else:
-        recomendations_amount = min(5, len(globalVar['keywords']))
-        list_of_recomendations = random.sample(list(globalVar['keywords'].keys()), recomendations_amount)
+        recomendations_amount = min(5, len(keywords))
+        list_of_recomendations = random.sample(list(keywords.keys()), recomendations_amount)
         recomendation_output = ""
         for possible_topic in list_of_recomendations:
             recomendation_output += f"<a href='/relacao?entre={possible_topic}'>{possible_topic}</a>, "
-        globalVar["recomendations_topicrelation"] = recomendation_output[:-2]
+        view["recomendations_topicrelation"] = recomendation_output[:-2]
+
+
+    return render_template('info.html', globalVar=view, scroll_to_relation=True)
+
+
+def apply_update(current):
+    # new articles were appended ("ingest.py --novos"): reload the data and
+    # forget only the searches about the topics the new articles match
+    global manifest
+    keywords = updated_keywords(PARQUET_PATH, manifest["generation"], current["generation"])
+    load_data(current, engine)
+
+    # (results of unknown topics are kept under the query as typed)
+    touched = {fold(keyword) for keyword in keywords}
+    affected = lambda query: any(fold(keyword) in touched for keyword in keywords_of(query, is_keyword))
+    results.discard_if(affected)
+    neighborhoods.discard_if(lambda key: affected(key[0]))
+    graph_documents.discard_if(lambda key: affected(key[0]))
+    query_cache.invalidate(keywords)
+    manifest = current
+
+def watch_updates():
+    while True:
+        socketio.sleep(ingest_poll)
+        try:
+            current = read_manifest(PARQUET_PATH)
+
+            # a full conversion (new dataset) needs a restart, every search changes
+            if (manifest is not None and current is not None and current["dataset"] == manifest["dataset"]
+                    and current["generation"] > manifest["generation"]):
+                apply_update(current)
+        except Exception:
+            # (the generation is retried on the next poll)
+            app.logger.exception("ingest update failed")
+
+if ingest_poll > 0:
+    socketio.start_background_task(watch_updates)
+
+
+def graph_options():
+    # number of topics (?nos=, GRAPH_NODES by default) and co-occurrence
+    # edges (?arestas=1) of the requested graph
+    try:
+        nodes = min(max(int(request.args.get('nos', GRAPH_NODES)), GRAPH_NODES), graph_max_nodes)
+    except ValueError:
+        nodes = GRAPH_NODES
+    return nodes, request.args.get('arestas') == '1'
+
+def neighborhood_size(nodes):
+    return min([size for size in neighborhood_sizes if size >= nodes] or [nodes])
+
+def build_neighborhood(key, size, progress):
+    profile = search_profile(key, progress, top_n=size)
+    return {"keywords": KeywordTable.from_keywords(profile.get("keywords", {})),
+            "all_sentiments": profile.get("all_sentiments")}
+
+def graph_keywords(key, result, nodes):
+    # keywords (and sentiment quantiles) of a graph of `nodes` topics: the
+    # search's own, or a larger neighborhood, aggregated once by a search
+    # job (None until it is done); an exact search with fewer keywords than
+    # it keeps already has all of them
+    keywords = len(result["keywords"])
+    if nodes <= max(GRAPH_NODES, keywords) or (keywords < RESULT_KEYWORDS and "approximate" not in result):
+        return result
+    size = neighborhood_size(nodes)
+    neighborhood = neighborhoods.get((key, size))
+    if neighborhood is None:
+        jobs.submit((key, size), lambda progress: build_neighborhood(key, size, progress))
+    return neighborhood
+
+def graph_loading(key, nodes):
+    # loading page of a graph whose neighborhood is being aggregated
+    return render_template('loading.html', globalVar={**corpusVar, "query": key,
+                                                      "job": graph_room(key, neighborhood_size(nodes))}), 202
+
+def graph_document(key, result, nodes, edges):
+    # html of the search's graph with these options (None while its
+    # neighborhood is aggregated)
+    if nodes <= GRAPH_NODES and not edges:
+        return result["graph_html"]
+    document = graph_documents.get((key, nodes, edges))
+    if document is None:
+        source = graph_keywords(key, result, nodes)
+        if source is None:
+            return None
+
+        # topics already placed (default graph, "mostrar mais") keep their place
+        links = cooccurrence.edges(source["keywords"]) if edges and cooccurrence is not None else None
+        document = create_keyword_graph(source["keywords"], nodes, key, source["all_sentiments"],
+                                        result.setdefault("layout", {}), links)
+        graph_documents.put((key, nodes, edges), document)
+    return document
+
+@app.route('/grafo/documento')
+def grafo_documento():
+    # the graph's own document (the iframe of graph.html)
+    key = normalize_query(request.args.get('topico', ''))
+    result = find_result(key)
+    if result is None or result["zero_results"]:
+        return render_template('404.html', globalVar=session_view()), 404
+
+    nodes, edges = graph_options()
+    document = graph_document(key, result, nodes, edges)
+    if document is None:
+        return graph_loading(key, nodes)
+
+    response = make_response(document)
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/grafo/no')
+def grafo_no():
+    # info panel of a graph's node, fetched when the node is clicked
+    key = normalize_query(request.args.get('topico', ''))
+    result = find_result(key)
+    if result is None or result["zero_results"]:
+        return jsonify({"erro": "pesquisa desconhecida"}), 404
+
+    nodes, _ = graph_options()
+    source = graph_keywords(key, result, nodes)
+    if source is None:
+        return jsonify({"topico": key, "estado": "a calcular"}), 202
+    node = node_detail(source['keywords'], nodes, key, request.args.get('no', ''),
+                       source['all_sentiments'])
+    if node is None:
+        return jsonify({"erro": "topico fora do grafo"}), 404
+    return jsonify({"topico": key, **node})
+
+@app.route('/grafo/mais')
+def grafo_mais():
+    # "mostrar mais": the k topics after the ?nos= drawn ones, placed around
+    # them (the drawn nodes are not sent again nor moved)
+    key = normalize_query(request.args.get('topico', ''))
+    result = find_result(key)
+    if result is None or result["zero_results"]:
+        return jsonify({"erro": "pesquisa desconhecida"}), 404
+
+    nodes, _ = graph_options()
+    try:
+        more = min(max(int(request.args.get('k', GRAPH_MORE)), 1), GRAPH_NODES)
+    except ValueError:
+        more = GRAPH_MORE
+    total = min(nodes + more, graph_max_nodes)
+    source = graph_keywords(key, result, total)
+    if source is None:
+        return jsonify({"topico": key, "estado": "a calcular"}), 202
+    delta = expand_graph(source['keywords'], nodes, total, key, source['all_sentiments'],
+                         result.setdefault("layout", {}))
+
+    # (a graph of GRAPH_MAX_NODES topics has nothing more to show)
+    return jsonify({"topico": key, **delta, "fim": delta["fim"] or total >= graph_max_nodes})
+
+
+@app.route('/sugestoes')
+def sugestoes():
+    # autocomplete: most common keywords starting with the typed text
+    # (?n= suggestions, 10 by default, at most 50)
+    prefix = request.args.get('q', '')
+    try:
+        n = min(max(int(request.args.get('n', 10)), 1), 50)
+    except ValueError:
+        n = 10
+    return jsonify([{"topico": keyword, "noticias": count}
+                    for keyword, count in vocabulary.suggest(prefix, n)])
+
+
+def warm_topics(topics):
+    # corpus keywords of topics to warm up, as /pesquisa resolves them (the
+    # cache is keyed by them), and the topics that are no keyword
+    keywords = [vocabulary.canonical(normalize_query(topic)) for topic in topics]
+    return ([keyword for keyword in keywords if keyword is not None],
+            [topic for topic, keyword in zip(topics, keywords) if keyword is None])
+
+def admin_denied():
+    # the error response of an /admin request without the admin token, if any
+    if not admin_token:
+        return jsonify({"erro": "administracao desativada (ADMIN_TOKEN)"}), 403
+    sent = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(sent.encode(), admin_token.encode()):
+        return jsonify({"erro": "token invalido"}), 401
+    return None
+
+@app.route('/admin/cache')
+def admin_cache():
+    # hit/miss/eviction counters and disk usage of the query cache
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    return jsonify({**query_cache.stats(), "falhas": list(batch_failures)})
+
+@app.route('/admin/precalcular', methods=['POST'])
+def admin_precalcular():
+    # warm the cache for a list of topics and/or the top N corpus keywords,
+    # with a single shared scan, in the background
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+
+    topics, unknown = warm_topics(request.form.getlist('topico'))
+    try:
+        top = int(request.form.get('top', 0))
+    except ValueError:
+        top = -1
+    if top < 0:
+        return jsonify({"erro": "top deve ser um inteiro >= 0"}), 400
+
+    def batch(progress):
+        return query_cache.warm(engine, build_result,
+                                topics + (warm_topics(engine.top_topics(top))[0] if top else []))
+
+    # one job per warm-up: an identical one already running is shared, any
+    # other waits for its turn
+    batch_jobs.submit(("precalcular", top, *sorted(topics)), batch)
+    return jsonify({"topicos": topics, "desconhecidos": unknown, "top": top,
+                    "falhas": list(batch_failures)}), 202
 
-    
-    return render_template('info.html', globalVar=globalVar, scroll_to_relation=True)
-    
-    
 
 if __name__ == '__main__':
     socketio.run(app, debug=True)
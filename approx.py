@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# %% [markdown]
+# modo aproximado para topicos muito abrangentes: o perfil e calculado
+# sobre uma amostra estratificada por mes das noticias encontradas e
+# depois extrapolado para o total, com margens de erro
+#
+# o numero de noticias por mes e exato (vem dos proprios estratos), as
+# contagens dos topicos relacionados e das fontes sao estimativas
+
+# %%
+
+def stratified_sample(row_ids, months, size, seed=0):
+    # proportional allocation, at least one news per month
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    fraction = min(1.0, size / len(row_ids))
+
+    sample, strata = [], {}
+    for month in np.unique(months):
+        stratum = row_ids[months == month]
+        taken = max(1, int(round(len(stratum) * fraction)))
+        sample.append(rng.choice(stratum, taken, replace=False))
+        strata[int(month)] = (len(stratum), taken)
+
+    return np.sort(np.concatenate(sample)), strata
+
+def margin(news, sampled, total, z=1.96):
+    # relative 95% margin of a count estimated from `news` of `sampled` news
+    # (share of the sample, without replacement from `total`)
+    if news == 0:
+        return 1.0
+    share = news / sampled
+    return float(z * np.sqrt((1 - share) / news * (1 - sampled / total)))
+
+def scale_profile(profile, strata):
+    # extrapolate a profile computed on the sample to every matched news
+    if profile["amount_of_news"] == 0:
+        return profile
+    total = sum(count for count, _ in strata.values())
+    sampled = sum(taken for _, taken in strata.values())
+    weights = {month: count / taken for month, (count, taken) in strata.items()}
+    factor = total / sampled
+
+    scaled = dict(profile)
+    scaled["amount_of_news"] = total
+    scaled["first_news"] = min(strata)
+    scaled["news_by_month"] = pd.DataFrame({
+        "timestamp": list(strata),
+        "count_of_news": [count for count, _ in strata.values()]})
+    scaled["sources"] = profile["sources"].assign(
+        count=(profile["sources"]["count"] * factor).round().astype(int))
+
+    scaled["keywords"] = {}
+    for key, value in profile["keywords"].items():
+        dates = {month: int(round(mentions * weights.get(month, factor)))
+                 for month, mentions in value["date"].items()}
+        scaled["keywords"][key] = {
+            **value,
+            "count": sum(dates.values()),
+            "date": dates,
+            "source": {source: int(round(count * factor))
+                       for source, count in value["source"].items()},
+            "margin": margin(len(value["news"]), sampled, total)}
+
+    # typical margin of the graph's keywords
+    margins = [value["margin"] for value in scaled["keywords"].values()]
+    scaled["approximate"] = {"sampled": sampled, "total": total,
+                             "margin": float(np.median(margins)) if margins else 0.0}
+    return scaled
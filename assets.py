@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import plotly
+from plotly.offline import get_plotlyjs
+
+# %% [markdown]
+# plotly.js servido uma so vez de static/ (em vez de ir dentro de cada
+# grafico): o nome do ficheiro tem a versao do plotly, por isso o browser
+# pode guarda-lo para sempre
+
+# %%
+
+PLOTLY_JS = f"js/plotly-{plotly.__version__}.min.js"
+PLOTLY_JS_URL = f"/static/{PLOTLY_JS}"
+
+# versioned files never change under the same name
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def write_plotly_js(static_folder):
+    # the bundle shipped with the installed plotly, written once
+    path = os.path.join(static_folder, PLOTLY_JS)
+    if os.path.exists(path):
+        return path
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as js_file:
+        js_file.write(get_plotlyjs())
+    os.replace(tmp_path, path)
+    return path
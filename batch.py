@@ -0,0 +1,63 @@
+from pyspark.sql import functions as F
+import argparse
+import sys
+
+from aggregation import keyword_cube, profile_from_cube
+
+# %% [markdown]
+# pre-calcular muitos topicos com um unico scan
+
+# %%
+
+def top_topics(index, n, min_count=5):
+    # the n keywords with most matching news in the corpus
+    rows = (
+        index["postings"]
+        .filter(F.col("count") >= min_count)
+        .groupBy("keyword")
+        .count()
+        .orderBy(F.desc("count"))
+        .limit(n)
+        .collect()
+    )
+    return [row["keyword"] for row in rows]
+
+def batch_profiles(index, topics, min_count=5, top_n=200):
+    # one pass over the postings and the articles for every topic: each
+    # matching article is tagged with the topics it belongs to
+    matches = (
+        index["postings"]
+        .filter(F.col("keyword").isin(list(topics)) & (F.col("count") >= min_count))
+        .select("row_id", F.col("keyword").alias("topic"))
+    )
+    tagged = index["articles"].join(matches, on="row_id", how="inner")
+
+    # one shared shuffle, cached, then each topic reads its own slice
+    cube = keyword_cube(tagged, by=("topic",)).cache()
+    try:
+        for topic in topics:
+            topic_cube = cube.filter(F.col("topic") == topic).drop("topic")
+            yield topic, profile_from_cube(topic_cube, topic, top_n=top_n)
+    finally:
+        cube.unpersist()
+
+# %%
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pré-calcular tópicos na cache de pesquisas")
+    parser.add_argument("topics", nargs="*", help="tópicos a pré-calcular")
+    parser.add_argument("--top", type=int, default=0, help="mais os N tópicos mais frequentes do corpus")
+    args = parser.parse_args(sys.argv[1:])
+
+    # needs the engine, the data and the renderers, so it goes through the app
+    # (topics are cached under their corpus keyword, as /pesquisa finds them)
+    from app import engine, query_cache, build_result, warm_topics
+
+    topics, unknown = warm_topics(args.topics)
+    if args.top:
+        topics += warm_topics(engine.top_topics(args.top))[0]
+
+    computed = query_cache.warm(engine, build_result, topics)
+    print(f"{len(computed)} topics computed, {len(set(topics)) - len(computed)} already cached")
+    if unknown:
+        print(f"not in the corpus, skipped: {', '.join(unknown)}")
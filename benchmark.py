@@ -0,0 +1,162 @@
+from pyspark.sql import SparkSession
+import sys
+import time
+
+from index import load_index, filter_news
+from aggregation import keyword_aggregation
+
+# %% [markdown]
+# comparar a agregacao em DataFrame com o antigo caminho RDD
+
+# %%
+
+def keyword_aggregation_rdd(df_with_query, min_count=5):
+    result = (
+        df_with_query.rdd
+        .flatMap(lambda row: [
+            (key, (value,
+                {row["timestamp"]: value},
+                row["sentiment"]*value,
+                {row["source"]: 1},
+                [row["archive"]])) for key, value in row["keywords"].items()
+        ])
+        .reduceByKey(lambda a, b: (
+            a[0] + b[0],  # Sum count values
+            {ts: a[1].get(ts, 0) + b[1].get(ts, 0) for ts in set(a[1]) | set(b[1])},  # Merge timestamp counts
+            a[2] + b[2],  # Sum sentiment values
+            {source: a[3].get(source, 0) + b[3].get(source, 0) for source in set(a[3]) | set(b[3])},  # Merge source counts
+            a[4] + b[4]  # Merge archive lists
+        ))
+        .collect()
+    )
+    keywords = {key: {"count": value[0],
+                      "date": value[1],
+                      "sentiment": value[2]/value[0],
+                      "source": {("null" if k is None else k): v for k, v in value[3].items()},
+                      "news": value[4]} for key, value in result}
+    return {k: v for k, v in keywords.items() if v["count"] >= min_count}
+
+def same_result(a, b):
+    if a.keys() != b.keys():
+        return False
+    for key in a:
+        if (a[key]["count"] != b[key]["count"]
+                or a[key]["date"] != b[key]["date"]
+                or a[key]["source"] != b[key]["source"]
+                or sorted(a[key]["news"]) != sorted(b[key]["news"])
+                or abs(a[key]["sentiment"] - b[key]["sentiment"]) > 1e-6):
+            return False
+    return True
+
+def same_profile(a, b):
+    # filter, source pie, monthly series and keyword aggregation
+    # (the monthly top 5 is left out: ties are broken differently)
+    if a["amount_of_news"] != b["amount_of_news"]:
+        return False
+    if a["amount_of_news"] == 0:
+        return True
+    sources = lambda p: p["sources"].sort_values("source").to_dict("list")
+    months = lambda p: p["news_by_month"].sort_values("timestamp").to_dict("list")
+    return (a["first_news"] == b["first_news"]
+            and sources(a) == sources(b)
+            and months(a) == months(b)
+            and same_result(a["keywords"], b["keywords"]))
+
+def compare_engines(queries):
+    from engine import make_engine
+    engines = {name: make_engine(name) for name in ("spark", "arrow")}
+
+    print(f"{'query':<20}{'news':>8}{'spark (s)':>11}{'arrow (s)':>11}  equal")
+    for query in queries:
+        times, profiles = {}, {}
+        for name, engine in engines.items():
+            times[name], profiles[name] = timed(
+                lambda: engine.profile(engine.lookup(query), query, top_n=None))
+        print(f"{query:<20}{profiles['arrow']['amount_of_news']:>8}"
+              f"{times['spark']:>11.2f}{times['arrow']:>11.2f}"
+              f"  {same_profile(profiles['spark'], profiles['arrow'])}")
+
+def matplotlib_charts(data, spans, colors):
+    # the old renderer: one figure and one png per topic
+    import base64
+    from io import BytesIO
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    charts = []
+    for node, (first, last), color in zip(data, spans, colors):
+        date = data[node]["date"]
+        times_said_by_year = {str(k): 0 for k in range(first, last+1)}
+        for key in date.keys():
+            times_said_by_year[str(key)[:4]] += int(date[key])
+        plt.figure(figsize=(6, 4))
+        plt.bar(times_said_by_year.keys(), times_said_by_year.values(), color=color)
+        plt.xlabel('Ano')
+        plt.ylabel('Número de Menções')
+        plt.grid(axis='y', alpha=0.2)
+        plt.tight_layout()
+        buffer = BytesIO()
+        plt.savefig(buffer, format='png', transparent=True)
+        plt.close()
+        charts.append(base64.b64encode(buffer.getvalue()).decode('utf-8'))
+    return charts
+
+def compare_charts(queries, nodes=125):
+    # yearly charts of a graph's nodes: matplotlib per node vs batched svg
+    from engine import make_engine
+    from charts import year_charts
+    from keywordtable import KeywordTable
+    engine = make_engine()
+
+    print(f"{'query':<20}{'nodes':>6}{'png (s)':>10}{'svg (s)':>10}{'speedup':>9}")
+    for query in queries:
+        keywords = KeywordTable.from_keywords(engine.profile(engine.lookup(query), query, top_n=nodes)["keywords"])
+        top = keywords.take(keywords.top(nodes))
+        spans = [(first // 100, last // 100) for first, last in zip(*top.news_range())]
+        colors = ["#CCCCCC"] * len(top)
+
+        png_time, _ = timed(matplotlib_charts, top, spans, colors, repeat=1)
+        svg_time, _ = timed(year_charts, top, spans, colors)
+        print(f"{query:<20}{len(top):>6}{png_time:>10.2f}{svg_time:>10.3f}{png_time/svg_time:>8.0f}x")
+
+def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+# %%
+
+if __name__ == "__main__":
+    # python benchmark.py --engines [queries]: Spark vs Arrow engine
+    if sys.argv[1:2] == ["--engines"]:
+        compare_engines(sys.argv[2:] or ["Portugal", "Lisboa", "Benfica"])
+        sys.exit()
+
+    # python benchmark.py --charts [queries]: graph node charts
+    if sys.argv[1:2] == ["--charts"]:
+        compare_charts(sys.argv[2:] or ["Portugal", "Lisboa", "Benfica"])
+        sys.exit()
+
+    spark = SparkSession.builder \
+        .appName("News Benchmark") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+
+    index = load_index(spark)
+    queries = sys.argv[1:] or ["Portugal", "Lisboa", "Benfica"]
+
+    print(f"{'query':<20}{'news':>8}{'rdd (s)':>10}{'df (s)':>10}{'speedup':>9}  equal")
+    for query in queries:
+        df_with_q = filter_news(index, query).cache()
+        amount_of_news = df_with_q.count()
+
+        rdd_time, rdd_result = timed(keyword_aggregation_rdd, df_with_q)
+        df_time, df_result = timed(keyword_aggregation, df_with_q)
+
+        print(f"{query:<20}{amount_of_news:>8}{rdd_time:>10.2f}{df_time:>10.2f}"
+              f"{rdd_time/df_time:>8.1f}x  {same_result(rdd_result, df_result)}")
+        df_with_q.unpersist()
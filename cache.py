@@ -0,0 +1,306 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from keywordfile import write_keywords, KeywordFile
+from manifest import read_manifest
+from queries import keywords_of
+from vocabulary import fold
+
+# %% [markdown]
+# cache de todos os artefactos de uma pesquisa
+
+# %%
+
+# bump whenever the result layout or the way it is rendered changes
+CACHE_VERSION = 9
+
+def dataset_fingerprint(path):
+    # changes whenever a file under path is added, removed or rewritten
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            files.append(f"{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return hashlib.sha256("\n".join(sorted(files)).encode()).hexdigest()
+
+def cache_fingerprint(news_path, parquet_path):
+    # the conversion's dataset id: stable across incremental updates, which
+    # invalidate only the topics they touch (json files before the manifest)
+    manifest = read_manifest(parquet_path)
+    return manifest["dataset"] if manifest is not None else dataset_fingerprint(news_path)
+
+def encode_result(result):
+    # json friendly copy of a search result
+    encoded = {}
+    for key, value in result.items():
+        if isinstance(value, pd.DataFrame):
+            value = {"__dataframe__": value.to_dict(orient="list")}
+        encoded[key] = value
+    return encoded
+
+def decode_result(encoded):
+    result = {}
+    for key, value in encoded.items():
+        if isinstance(value, dict) and "__dataframe__" in value:
+            value = pd.DataFrame(value["__dataframe__"])
+        result[key] = value
+    return result
+
+class QueryCache:
+    # one entry per query: <key>.json (rendered artifacts, written last so it
+    # marks a complete entry), <key>.kw (keywords) and <key>.meta (query,
+    # creation time and hit count, for listing and lfu eviction)
+
+    def __init__(self, directory, fingerprint, version=CACHE_VERSION,
+                 max_bytes=None, policy="lru"):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"unknown eviction policy: {policy}")
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.version = version
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, query):
+        # full hash of query, dataset and format: no collisions, no stale entries
+        return hashlib.sha256(f"{self.version}\0{self.fingerprint}\0{query}".encode()).hexdigest()
+
+    def _file(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def path(self, query, extension="json"):
+        return self._file(self.key(query), extension)
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _write_atomic(self, path, write):
+        # readers only ever see complete files
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _write_meta(self, key, meta):
+        def write(path):
+            with open(path, 'w') as json_file:
+                json.dump(meta, json_file)
+        self._write_atomic(self._file(key, "meta"), write)
+
+    def _record_hit(self, key):
+        # one more hit in the entry's metadata (rewritten whole, like the entry)
+        with self._lock:
+            try:
+                with open(self._file(key, "meta"), 'r') as json_file:
+                    meta = json.load(json_file)
+            except FileNotFoundError:
+                return
+            if os.path.exists(self._file(key, "json")):
+                self._write_meta(key, {**meta, "hits": meta.get("hits", 0) + 1})
+
+    def get(self, query):
+        key = self.key(query)
+        try:
+            with open(self._file(key, "json"), 'r') as json_file:
+                entry = json.load(json_file)
+
+            # keywords stay on disk, each one is decoded when it is used
+            keywords = KeywordFile(self._file(key, "kw"))
+        except FileNotFoundError:
+            # never written, or evicted meanwhile
+            self._count("misses")
+            return None
+
+        # access time (lru) and frequency (lfu) for eviction
+        os.utime(self._file(key, "json"))
+        self._record_hit(key)
+        self._count("hits")
+
+        result = decode_result(entry["result"])
+        result["keywords"] = keywords
+        return result
+
+    def put(self, query, result):
+        key = self.key(query)
+
+        # keywords go to the compact binary file, everything else to json
+        self._write_atomic(self._file(key, "kw"),
+                           lambda path: write_keywords(path, result["keywords"]))
+
+        rest = {k: v for k, v in result.items() if k != "keywords"}
+        def write_json(path):
+            with open(path, 'w') as json_file:
+                json.dump({"query": query,
+                           "version": self.version,
+                           "fingerprint": self.fingerprint,
+                           "result": encode_result(rest)}, json_file)
+        self._write_atomic(self._file(key, "json"), write_json)
+
+        self._write_meta(key, {"query": query,
+                               "version": self.version,
+                               "fingerprint": self.fingerprint,
+                               "created": time.time(),
+                               "hits": 0})
+        self._count("writes")
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes, keep=key)
+
+    def entries(self):
+        # every complete entry in the directory, with its size and usage
+        files = {}
+        for name in os.listdir(self.directory):
+            key, _, extension = name.partition(".")
+            if extension in ("json", "kw", "meta"):
+                files.setdefault(key, {})[extension] = os.path.join(self.directory, name)
+
+        entries = []
+        for key, paths in files.items():
+            try:
+                with open(paths["meta"], 'r') as json_file:
+                    meta = json.load(json_file)
+                entries.append({"hits": 0,
+                                **meta,
+                                "key": key,
+                                "size": sum(os.path.getsize(p) for p in paths.values()),
+                                "last_access": os.path.getmtime(paths["json"])})
+            except (KeyError, FileNotFoundError):
+                # half written or being removed
+                continue
+        return entries
+
+    def remove(self, key):
+        # the json goes first, so the entry stops being served right away
+        for extension in ("json", "kw", "meta"):
+            try:
+                os.remove(self._file(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, max_bytes, keep=None):
+        entries = self.entries()
+        if self.policy == "lru":
+            entries.sort(key=lambda e: e["last_access"])
+        else:
+            entries.sort(key=lambda e: (e["hits"], e["last_access"]))
+
+        total = sum(e["size"] for e in entries)
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if entry["key"] == keep:
+                continue
+            self.remove(entry["key"])
+            total -= entry["size"]
+            self._count("evictions")
+
+    def purge(self, queries=None, stale_only=False):
+        # remove the given queries (any version), stale entries, or everything
+        removed = 0
+        for entry in self.entries():
+            stale = entry["version"] != self.version or entry["fingerprint"] != self.fingerprint
+            if queries is not None and entry["query"] not in queries:
+                continue
+            if stale_only and not stale:
+                continue
+            self.remove(entry["key"])
+            removed += 1
+        return removed
+
+    def invalidate(self, keywords):
+        # remove the searches about any of the keywords (new articles match them)
+        keywords = set(keywords)
+        removed = 0
+        for entry in self.entries():
+            if keywords.intersection(keywords_of(entry["query"], lambda query: query in keywords)):
+                self.remove(entry["key"])
+                removed += 1
+        return removed
+
+    def warm(self, engine, build_result, topics):
+        # compute (sharing one scan where the engine can) and store every
+        # topic that is not cached yet
+        missing = [topic for topic in dict.fromkeys(topics) if not os.path.exists(self.path(topic))]
+        for topic, profile in engine.batch_profiles(missing):
+            self.put(topic, build_result(topic, profile))
+        return missing
+
+    def stats(self):
+        entries = self.entries()
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        return {**counters,
+                "hit_rate": counters["hits"]/lookups if lookups else None,
+                "entries": len(entries),
+                "bytes": sum(e["size"] for e in entries),
+                "max_bytes": self.max_bytes,
+                "policy": self.policy}
+
+# %%
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Gerir a cache de pesquisas")
+    parser.add_argument("--directory", default="cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="listar as entradas")
+    purge = commands.add_parser("purge", help="remover entradas")
+    purge.add_argument("topics", nargs="*", help="tópicos a remover (todos se vazio)")
+    purge.add_argument("--stale", action="store_true", help="só entradas de outra versão ou dataset")
+    warm = commands.add_parser("warm", help="pré-calcular tópicos")
+    warm.add_argument("topics", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "warm":
+        # needs Spark and the data, so it goes through the app
+        from app import engine, query_cache, build_result, warm_topics
+        topics, unknown = warm_topics(args.topics)
+        computed = query_cache.warm(engine, build_result, topics)
+        print(f"{len(computed)} topics computed")
+        if unknown:
+            print(f"not in the corpus, skipped: {', '.join(unknown)}")
+        return
+
+    from paths import NEWS_PATH, PARQUET_PATH
+    cache = QueryCache(args.directory, cache_fingerprint(NEWS_PATH, PARQUET_PATH))
+
+    if args.command == "list":
+        entries = sorted(cache.entries(), key=lambda e: e["last_access"], reverse=True)
+        for entry in entries:
+            stale = entry["version"] != cache.version or entry["fingerprint"] != cache.fingerprint
+            print(f"{entry['query']:<30}{entry['size']/2**20:>9.2f} MB{entry['hits']:>7} hits  "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_access']))}"
+                  f"{'  (stale)' if stale else ''}")
+        print(f"{len(entries)} entries, {sum(e['size'] for e in entries)/2**20:.2f} MB")
+
+    elif args.command == "purge":
+        # entries are keyed by the corpus spelling ("lisboa" is "Lisboa")
+        queries, missing = None, []
+        if args.topics:
+            queries = {entry["query"] for entry in cache.entries()
+                       if fold(entry["query"]) in {fold(topic) for topic in args.topics}}
+            missing = [topic for topic in args.topics if fold(topic) not in {fold(query) for query in queries}]
+        removed = cache.purge(queries, stale_only=args.stale)
+        print(f"{removed} entries removed")
+        if missing:
+            print(f"not in the cache: {', '.join(missing)}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,92 @@
+import html
+
+import numpy as np
+
+# %% [markdown]
+# graficos de barras das mencoes por ano de cada topico, em SVG
+#
+# todos os graficos sao feitos de uma vez a partir de uma matriz
+# topico x ano (dos meses de uma KeywordTable): escalas, marcas do eixo e
+# barras sao calculadas em NumPy, so a escrita do SVG e por barra (antes:
+# uma figura matplotlib e um PNG por topico)
+#
+# o aspeto e o do antigo grafico: 6x4 polegadas, barras da cor do
+# sentimento, grelha horizontal suave, eixos "Ano" e "Numero de Mencoes"
+
+# %%
+
+WIDTH, HEIGHT = 600, 400
+LEFT, RIGHT, TOP, BOTTOM = 70, 10, 10, 50
+STEPS = np.array([1, 2, 5, 10])
+
+def yearly_matrix(data, spans):
+    # (first year, mentions[topic, year]) from a KeywordTable's months
+    first = min(start for start, _ in spans)
+    last = max(end for _, end in spans)
+    topics = np.repeat(np.arange(len(data)), np.diff(data.month_offsets))
+    years = data.months // 100 - first
+
+    matrix = np.zeros((len(data), last - first + 1), dtype=np.int64)
+    inside = (years >= 0) & (years <= last - first)
+    np.add.at(matrix, (topics[inside], years[inside]), data.month_counts[inside])
+    return first, matrix
+
+def tick_steps(top, ticks=5):
+    # round step (1, 2 or 5 times a power of ten) giving at most `ticks` intervals
+    raw = np.maximum(top / ticks, 1)
+    magnitude = 10.0 ** np.floor(np.log10(raw))
+    multiple = STEPS[np.argmax(STEPS[None, :] * magnitude[:, None] >= raw[:, None], axis=1)]
+    return (multiple * magnitude).astype(np.int64)
+
+def year_charts(data, spans, colors):
+    # one svg per topic of a KeywordTable: spans are the (first, last) year
+    # shown and colors the bar color of each topic
+    if len(data) == 0:
+        return []
+    first, matrix = yearly_matrix(data, spans)
+    starts = np.array([start for start, _ in spans]) - first
+    lengths = np.array([end - start + 1 for start, end in spans])
+
+    # y axis: 5% above the tallest bar, like matplotlib's margins
+    plot_width, plot_height = WIDTH - LEFT - RIGHT, HEIGHT - TOP - BOTTOM
+    top = np.maximum(matrix.max(axis=1), 1) * 1.05
+    steps = tick_steps(top)
+    scale = plot_height / top
+
+    # x axis: bars take 80% of their year's slot
+    slots = plot_width / lengths
+    heights = matrix * scale[:, None]
+
+    charts = []
+    for topic in range(len(data)):
+        color = html.escape(colors[topic])
+        slot, length = slots[topic], lengths[topic]
+        label_every = int(np.ceil(length / 12))
+        parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {WIDTH} {HEIGHT}" '
+                 f'width="100%" font-family="Arial, sans-serif" font-size="13">']
+
+        # grid and y ticks
+        for value in range(0, int(top[topic]) + 1, int(steps[topic])):
+            y = TOP + plot_height - value * scale[topic]
+            parts.append(f'<line x1="{LEFT}" x2="{WIDTH-RIGHT}" y1="{y:.1f}" y2="{y:.1f}" '
+                         f'stroke="black" stroke-opacity="0.2"/>'
+                         f'<text x="{LEFT-6}" y="{y+4:.1f}" text-anchor="end">{value}</text>')
+
+        # bars and x ticks
+        for year in range(length):
+            x = LEFT + (year + 0.1) * slot
+            height = heights[topic, starts[topic] + year]
+            parts.append(f'<rect x="{x:.1f}" y="{TOP+plot_height-height:.1f}" width="{0.8*slot:.1f}" '
+                         f'height="{height:.1f}" fill="{color}"><title>{matrix[topic, starts[topic]+year]}</title></rect>')
+            if year % label_every == 0:
+                parts.append(f'<text x="{x+0.4*slot:.1f}" y="{TOP+plot_height+18}" '
+                             f'text-anchor="middle">{first+starts[topic]+year}</text>')
+
+        parts.append(f'<rect x="{LEFT}" y="{TOP}" width="{plot_width}" height="{plot_height}" '
+                     f'fill="none" stroke="black"/>'
+                     f'<text x="{LEFT+plot_width/2}" y="{HEIGHT-8}" text-anchor="middle">Ano</text>'
+                     f'<text transform="translate(16 {TOP+plot_height/2}) rotate(-90)" '
+                     f'text-anchor="middle">Número de Menções</text></svg>')
+        charts.append("".join(parts))
+
+    return charts
@@ -0,0 +1,210 @@
+from array import array
+import json
+import os
+
+import numpy as np
+
+from paths import COOCCURRENCE_PATH
+
+# %% [markdown]
+# matriz esparsa (CSR) de coocorrencia entre palavras-chave
+#
+# linha a, coluna b: mencoes de b (e soma do sentimento*mencoes) nas
+# noticias que mencionam a pelo menos 5 vezes, ou seja, o que a pesquisa
+# de a agrega para b
+
+# %%
+
+def cooccurrence_pairs(postings_ids, min_count=5):
+    # (a, b) pairs within the same article, a being a matching query,
+    # streamed sorted into compact arrays on the driver
+    from pyspark.sql import functions as F
+
+    queries = postings_ids.filter(F.col("count") >= min_count).select("row_id", F.col("id").alias("a"))
+    mentions = postings_ids.select("row_id", F.col("id").alias("b"), "count", "sentiment")
+    pairs = (
+        queries.join(mentions, on="row_id")
+        .groupBy("a", "b")
+        .agg(F.sum("count").alias("count"),
+             F.sum(F.col("sentiment") * F.col("count")).alias("sentiment_sum"))
+        .orderBy("a", "b")
+    )
+
+    rows, indices, counts, sentiments = array("q"), array("i"), array("q"), array("d")
+    for row in pairs.toLocalIterator():
+        rows.append(row["a"])
+        indices.append(row["b"])
+        counts.append(row["count"])
+        sentiments.append(row["sentiment_sum"] or 0.0)
+    return (np.frombuffer(rows, dtype=np.int64), np.frombuffer(indices, dtype=np.int32),
+            np.frombuffer(counts, dtype=np.int64), np.frombuffer(sentiments, dtype=np.float64))
+
+def save_matrix(path, keywords, rows, indices, counts, sentiments, doc_freq):
+    # rows sorted; every file is replaced atomically, so running readers
+    # keep their (memory mapped) copy until they reload
+    indptr = np.zeros(len(keywords) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(keywords)), out=indptr[1:])
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {"indptr": indptr, "indices": indices.astype(np.int32), "counts": counts.astype(np.int64),
+              "sentiment": sentiments.astype(np.float64), "doc_freq": doc_freq.astype(np.int64)}
+    for name, values in arrays.items():
+        np.save(f"{path}/{name}.tmp.npy", values)
+        os.replace(f"{path}/{name}.tmp.npy", f"{path}/{name}.npy")
+    with open(f"{path}/vocabulary.tmp.json", "w") as json_file:
+        json.dump(keywords, json_file)
+    os.replace(f"{path}/vocabulary.tmp.json", f"{path}/vocabulary.json")
+
+def build_cooccurrence(spark, index, path=COOCCURRENCE_PATH, min_count=5):
+    # Spark is only needed to build the matrix, not to read it
+    from pyspark.sql import functions as F
+
+    postings = index["postings"]
+
+    # vocabulary: every keyword, sorted, with the news that match it
+    vocabulary = (
+        postings
+        .groupBy("keyword")
+        .agg(F.sum((F.col("count") >= min_count).cast("long")).alias("doc_freq"))
+        .orderBy("keyword")
+        .collect()
+    )
+    keywords = [row["keyword"] for row in vocabulary]
+    doc_freq = np.array([row["doc_freq"] for row in vocabulary], dtype=np.int64)
+    ids = spark.createDataFrame(list(enumerate(keywords)), ["id", "keyword"])
+
+    pairs = cooccurrence_pairs(postings.join(F.broadcast(ids), on="keyword"), min_count)
+    save_matrix(path, keywords, *pairs, doc_freq)
+
+def update_cooccurrence(spark, new_postings, path=COOCCURRENCE_PATH, min_count=5):
+    # add the pairs of newly ingested articles to the matrix, without
+    # reading the older articles again
+    from pyspark.sql import functions as F
+
+    old = Cooccurrence(path)
+    vocabulary = (
+        new_postings
+        .groupBy("keyword")
+        .agg(F.sum((F.col("count") >= min_count).cast("long")).alias("doc_freq"))
+        .collect()
+    )
+
+    # merged vocabulary, and where the old keyword ids moved to
+    keywords = sorted(set(old.keywords) | {row["keyword"] for row in vocabulary})
+    position = {keyword: i for i, keyword in enumerate(keywords)}
+    remap = np.array([position[keyword] for keyword in old.keywords], dtype=np.int64)
+
+    doc_freq = np.zeros(len(keywords), dtype=np.int64)
+    doc_freq[remap] += old.doc_freq
+    for row in vocabulary:
+        doc_freq[position[row["keyword"]]] += row["doc_freq"]
+
+    ids = spark.createDataFrame([(position[row["keyword"]], row["keyword"]) for row in vocabulary],
+                                ["id", "keyword"])
+    new_rows, new_indices, new_counts, new_sentiments = cooccurrence_pairs(
+        new_postings.join(F.broadcast(ids), on="keyword"), min_count)
+
+    # old and new cells together, summed where both have the same pair
+    rows = np.concatenate([remap[np.repeat(np.arange(len(old.keywords)), np.diff(old.indptr))], new_rows])
+    indices = np.concatenate([remap[np.asarray(old.indices)], new_indices])
+    cells, inverse = np.unique(rows * len(keywords) + indices, return_inverse=True)
+    counts = np.zeros(len(cells), dtype=np.int64)
+    np.add.at(counts, inverse, np.concatenate([old.counts, new_counts]))
+    sentiments = np.zeros(len(cells), dtype=np.float64)
+    np.add.at(sentiments, inverse, np.concatenate([old.sentiment, new_sentiments]))
+
+    save_matrix(path, keywords, cells // len(keywords), cells % len(keywords), counts, sentiments, doc_freq)
+
+class Cooccurrence:
+    # memory mapped, so only the rows that are used are ever read
+
+    def __init__(self, path=COOCCURRENCE_PATH):
+        self.indptr = np.load(f"{path}/indptr.npy", mmap_mode="r")
+        self.indices = np.load(f"{path}/indices.npy", mmap_mode="r")
+        self.counts = np.load(f"{path}/counts.npy", mmap_mode="r")
+        self.sentiment = np.load(f"{path}/sentiment.npy", mmap_mode="r")
+        self.doc_freq = np.load(f"{path}/doc_freq.npy", mmap_mode="r")
+        with open(f"{path}/vocabulary.json", "r") as json_file:
+            self.keywords = json.load(json_file)
+        self.ids = {keyword: i for i, keyword in enumerate(self.keywords)}
+
+    def news_count(self, query):
+        # news mentioning the query at least min_count times
+        return int(self.doc_freq[self.ids[query]]) if query in self.ids else 0
+
+    def row(self, query, min_count=5):
+        # related keyword ids, counts and average sentiments (query excluded)
+        if query not in self.ids:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.int64), np.array([])
+        i = self.ids[query]
+        start, end = self.indptr[i], self.indptr[i+1]
+        indices = np.asarray(self.indices[start:end])
+        counts = np.asarray(self.counts[start:end])
+        keep = (counts >= min_count) & (indices != i)
+        return indices[keep], counts[keep], np.asarray(self.sentiment[start:end])[keep] / counts[keep]
+
+    def pair(self, query, topic):
+        # (count, average sentiment) of topic in the news about query, or None
+        if query not in self.ids or topic not in self.ids:
+            return None
+        i, j = self.ids[query], self.ids[topic]
+        start, end = self.indptr[i], self.indptr[i+1]
+        position = start + np.searchsorted(self.indices[start:end], j)
+        if position == end or self.indices[position] != j:
+            return None
+        return int(self.counts[position]), float(self.sentiment[position] / self.counts[position])
+
+    def top(self, query, n, min_count=5):
+        # the n most mentioned related keywords
+        indices, counts, _ = self.row(query, min_count)
+        if len(counts) > n:
+            best = np.argpartition(-counts, n - 1)[:n]
+            indices, counts = indices[best], counts[best]
+        return [self.keywords[j] for j in indices[np.argsort(-counts, kind="stable")].tolist()]
+
+    def edges(self, keywords, per_node=3, min_count=5):
+        # links between the given keywords: each one keeps its per_node
+        # most co-mentioned keywords of the set, as (a, b, count)
+        ids = np.array([self.ids[k] for k in keywords if k in self.ids], dtype=np.int64)
+        inside = np.zeros(len(self.keywords), dtype=bool)
+        inside[ids] = True
+
+        links = {}
+        for i in ids.tolist():
+            start, end = self.indptr[i], self.indptr[i+1]
+            indices = np.asarray(self.indices[start:end])
+            counts = np.asarray(self.counts[start:end])
+            keep = inside[indices] & (counts >= min_count) & (indices != i)
+            indices, counts = indices[keep], counts[keep]
+            if len(counts) > per_node:
+                best = np.argpartition(-counts, per_node - 1)[:per_node]
+                indices, counts = indices[best], counts[best]
+            for j, count in zip(indices.tolist(), counts.tolist()):
+                links[min(i, j), max(i, j)] = count
+        return [(self.keywords[i], self.keywords[j], count) for (i, j), count in links.items()]
+
+    def sentiment_quantiles(self, query, min_count=5):
+        _, _, sentiments = self.row(query, min_count)
+        if len(sentiments) == 0:
+            return None
+        return dict(zip(["q10", "q30", "q70", "q90"],
+                        np.quantile(sentiments, [0.1, 0.3, 0.7, 0.9]).tolist()))
+
+def load_cooccurrence(path=COOCCURRENCE_PATH):
+    # optional: built offline by running this module
+    if not os.path.exists(f"{path}/vocabulary.json"):
+        return None
+    return Cooccurrence(path)
+
+# %%
+
+if __name__ == "__main__":
+    from pyspark.sql import SparkSession
+    from index import load_index
+
+    spark = SparkSession.builder \
+        .appName("News Cooccurrence") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+
+    build_cooccurrence(spark, load_index(spark))
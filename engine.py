@@ -0,0 +1,32 @@
+import os
+
+# %% [markdown]
+# motor de consulta: Spark ou Arrow/pandas, com a mesma interface
+#
+# - corpus_stats() -> (numero de noticias, ultimo mes)
+# - lookup(query) -> row ids (ordenados) das noticias com >= 5 mencoes
+# - months(row_ids) -> mes de cada noticia
+# - profile(row_ids, query, ...) -> perfil da pesquisa (ver aggregation.py)
+# - keyword_detail(row_ids, topic) -> agregado de um topico, ou None
+# - keywords() -> (palavras-chave, numero de noticias de cada uma)
+# - top_topics(n) -> os n topicos com mais noticias
+# - batch_profiles(topics) -> (topico, perfil) para cada topico
+# - updated() -> o motor com os ficheiros acrescentados desde que foi criado
+#
+# lookup, months, profile e keyword_detail aceitam ainda window=(primeiro
+# mes, ultimo mes), para so ler as particoes desses meses
+
+# %%
+
+def make_engine(name=None):
+    name = name or os.environ.get("LUPA_ENGINE", "spark")
+
+    # each backend only imports its own dependencies
+    if name == "spark":
+        from engine_spark import SparkEngine
+        return SparkEngine()
+    if name == "arrow":
+        from engine_arrow import ArrowEngine
+        return ArrowEngine()
+
+    raise ValueError(f"unknown query engine: {name}")
@@ -0,0 +1,277 @@
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from paths import PARQUET_PATH
+from queries import as_keywords, in_window
+
+# %% [markdown]
+# motor de consulta sobre Arrow/NumPy (sem JVM), para dados que cabem numa
+# maquina: as tabelas parquet do ingest.py ficam em memoria, com as
+# palavras-chave indexadas por palavra e por noticia
+#
+# uma atualizacao incremental (ingest.py --novos) so le os ficheiros novos,
+# acrescentados aos arrays e aos indices ja em memoria
+#
+# produz os mesmos resultados que o motor Spark (aggregation.py)
+
+# %%
+
+class ArrowEngine:
+    def __init__(self, parquet_path=PARQUET_PATH):
+        if not os.path.exists(f"{parquet_path}/keywords"):
+            raise FileNotFoundError(f"{parquet_path}/keywords not found, run ingest.py first")
+        self.parquet_path = parquet_path
+
+        # empty engine, then every file appended at once
+        self.files = set()
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        self.timestamps = np.zeros(0, dtype=np.int64)
+        self.sources = np.zeros(0, dtype=object)
+        self.archives = np.zeros(0, dtype=object)
+        self.sentiments = np.zeros(0, dtype=np.float32)
+        self.vocabulary = pd.Index([], dtype=object)
+        self.keyword_positions = self.keyword_counts = np.zeros(0, dtype=np.int64)
+        self.keyword_offsets = np.zeros(1, dtype=np.int64)
+        self.news_codes = self.news_counts = np.zeros(0, dtype=np.int64)
+        self.news_offsets = np.zeros(1, dtype=np.int64)
+        self._append(*self._new_files())
+
+    def _new_files(self):
+        # news and keyword files not loaded yet
+        news = ds.dataset(f"{self.parquet_path}/news", format="parquet", partitioning="hive").files
+        keywords = ds.dataset(f"{self.parquet_path}/keywords", format="parquet").files
+        return ([path for path in news if path not in self.files],
+                [path for path in keywords if path not in self.files])
+
+    def updated(self):
+        # this engine plus the files appended since (ingest.py --novos): only
+        # those are read, and added to a copy of the indexes (in-flight
+        # searches keep using this one); a rewritten dataset is read again
+        news_files, keyword_files = self._new_files()
+        if not news_files and not keyword_files:
+            return self
+        engine = copy.copy(self)
+        try:
+            engine._append(news_files, keyword_files)
+        except ValueError:
+            return ArrowEngine(self.parquet_path)
+        return engine
+
+    def _append(self, news_files, keyword_files):
+        # news, sorted by row id, after the ones already loaded
+        news = (
+            ds.dataset(news_files, format="parquet", partitioning="hive",
+                       partition_base_dir=f"{self.parquet_path}/news")
+            .to_table(columns=["row_id", "timestamp", "source", "archive", "sentiment"])
+            .to_pandas()
+            .sort_values("row_id", kind="stable")
+        )
+        row_ids = news["row_id"].to_numpy(dtype=np.int64)
+        if len(self.row_ids) > 0 and len(row_ids) > 0 and row_ids[0] <= self.row_ids[-1]:
+            raise ValueError("appended news must have larger row ids")
+        old_news = len(self.row_ids)
+        self.row_ids = np.concatenate([self.row_ids, row_ids])
+        self.timestamps = np.concatenate([self.timestamps, news["timestamp"].to_numpy(dtype=np.int64)])
+        self.sources = np.concatenate([self.sources, news["source"].fillna("null").to_numpy(dtype=object)])
+        self.archives = np.concatenate([self.archives, news["archive"].to_numpy(dtype=object)])
+        self.sentiments = np.concatenate([self.sentiments, news["sentiment"].to_numpy(dtype=np.float32)])
+
+        # postings: keyword codes (into the sorted vocabulary), news positions, counts
+        postings = (
+            ds.dataset(keyword_files, format="parquet")
+            .to_table(columns=["keyword", "row_id", "count"])
+        )
+        keywords = pd.Categorical(postings.column("keyword").to_pandas())
+        vocabulary = self.vocabulary.union(keywords.categories)
+        remap = vocabulary.get_indexer(self.vocabulary)
+        codes = vocabulary.get_indexer(keywords.categories)[keywords.codes].astype(np.int64)
+        positions = np.searchsorted(self.row_ids, postings.column("row_id").to_numpy())
+        counts = postings.column("count").to_numpy().astype(np.int64)
+
+        # by keyword: each keyword's news, as a slice (the new news come last
+        # in every slice, a stable sort of the two sorted runs merges them)
+        old_codes = remap[np.repeat(np.arange(len(self.vocabulary)), np.diff(self.keyword_offsets))]
+        by_keyword = np.lexsort((positions, codes))
+        all_codes = np.concatenate([old_codes, codes[by_keyword]])
+        merged = np.argsort(all_codes, kind="stable")
+        self.keyword_positions = np.concatenate([self.keyword_positions, positions[by_keyword]])[merged]
+        self.keyword_counts = np.concatenate([self.keyword_counts, counts[by_keyword]])[merged]
+        self.keyword_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(all_codes, minlength=len(vocabulary)))])
+
+        # by news: each news' keywords, as a slice (the new news at the end)
+        by_news = np.lexsort((codes, positions))
+        self.news_codes = np.concatenate([remap[self.news_codes], codes[by_news]])
+        self.news_counts = np.concatenate([self.news_counts, counts[by_news]])
+        self.news_offsets = np.concatenate(
+            [self.news_offsets,
+             self.news_offsets[-1] + np.cumsum(np.bincount(positions - old_news, minlength=len(row_ids)))])
+
+        self.vocabulary = vocabulary
+        self.files = self.files | set(news_files) | set(keyword_files)
+
+    def _code(self, keyword):
+        # position in the vocabulary, -1 if unknown
+        return int(self.vocabulary.get_indexer([keyword])[0])
+
+    def _postings(self, keyword):
+        code = self._code(keyword)
+        if code < 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        start, end = self.keyword_offsets[code], self.keyword_offsets[code+1]
+        return self.keyword_positions[start:end], self.keyword_counts[start:end]
+
+    def corpus_stats(self):
+        return len(self.row_ids), int(self.timestamps.max())
+
+    def lookup(self, query, min_count=5, window=None):
+        positions, counts = self._postings(query)
+        positions = positions[counts >= min_count]
+        return self.row_ids[positions[in_window(self.timestamps[positions], window)]]
+
+    def months(self, row_ids, window=None):
+        return self.timestamps[np.searchsorted(self.row_ids, np.asarray(row_ids, dtype=np.int64))]
+
+    def _cube(self, row_ids):
+        # same cells as aggregation.keyword_cube: (keyword, month, source)
+        positions = np.searchsorted(self.row_ids, np.asarray(row_ids, dtype=np.int64))
+        starts = self.news_offsets[positions]
+        lengths = self.news_offsets[positions+1] - starts
+
+        # every (news, keyword) pair of those news
+        pairs = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) \
+            + np.arange(lengths.sum())
+        news = np.repeat(positions, lengths)
+        values = self.news_counts[pairs]
+
+        exploded = pd.DataFrame({
+            "code": self.news_codes[pairs],
+            "timestamp": self.timestamps[news],
+            "source": self.sources[news],
+            "value": values,
+            # float products, like Spark's FloatType * IntegerType
+            "sentiment_value": (self.sentiments[news] * values.astype(np.float32)).astype(np.float64),
+            "archive": self.archives[news],
+        })
+        return (
+            exploded
+            .groupby(["code", "timestamp", "source"], sort=False)
+            .agg(mentions=("value", "sum"),
+                 news_count=("value", "size"),
+                 sentiment_sum=("sentiment_value", "sum"),
+                 news=("archive", list))
+            .reset_index()
+        )
+
+    def _keywords(self, cube, exclude=(), top_n=None, keys=None, min_count=5):
+        # same as aggregation.keywords_from_cube + sentiment_quantiles
+        totals = cube.groupby("code").agg(count=("mentions", "sum"),
+                                          sentiment_sum=("sentiment_sum", "sum"))
+        totals = totals[(totals["count"] >= min_count) & ~totals.index.isin(list(exclude))]
+
+        sentiments = (totals["sentiment_sum"] / totals["count"]).to_numpy()
+        quantiles = None
+        if len(sentiments) > 0:
+            quantiles = dict(zip(["q10", "q30", "q70", "q90"],
+                                 np.quantile(sentiments, [0.1, 0.3, 0.7, 0.9]).tolist()))
+
+        if keys is not None:
+            totals = totals[totals.index.isin([self._code(key) for key in keys])]
+        elif top_n is not None:
+            totals = totals.nlargest(top_n, "count")
+
+        top = cube[cube["code"].isin(totals.index)]
+        dates = top.groupby(["code", "timestamp"])["mentions"].sum()
+        sources = top.groupby(["code", "source"])["news_count"].sum()
+        news = top.groupby("code")["news"].agg(lambda lists: [url for urls in lists for url in urls])
+
+        keywords = {}
+        for code, count, sentiment_sum in zip(totals.index, totals["count"], totals["sentiment_sum"]):
+            keywords[self.vocabulary[code]] = {
+                "count": int(count),
+                "date": {int(t): int(m) for t, m in dates.loc[code].items()},
+                "sentiment": float(sentiment_sum / count),
+                "source": {s: int(n) for s, n in sources.loc[code].items()},
+                "news": news.loc[code]}
+        return keywords, quantiles
+
+    def profile(self, row_ids, query, top_n=200, keys=None, all_sentiments=None, window=None):
+        if len(row_ids) == 0:
+            return {"amount_of_news": 0}
+
+        cube = self._cube(row_ids)
+        query_codes = [self._code(keyword) for keyword in as_keywords(query)]
+
+        # every matched news mentions a single keyword query, so its cells
+        # hold the news counts per month and per source; multi-topic
+        # queries count their news directly
+        if isinstance(query, str):
+            query_cells = cube[cube["code"] == query_codes[0]]
+        else:
+            positions = np.searchsorted(self.row_ids, np.asarray(row_ids, dtype=np.int64))
+            query_cells = (
+                pd.DataFrame({"timestamp": self.timestamps[positions], "source": self.sources[positions]})
+                .groupby(["timestamp", "source"]).size().rename("news_count").reset_index()
+            )
+        profile = {"amount_of_news": int(query_cells["news_count"].sum())}
+        if profile["amount_of_news"] == 0:
+            return profile
+
+        profile["first_news"] = int(query_cells["timestamp"].min())
+        profile["sources"] = (
+            query_cells.groupby("source", as_index=False)["news_count"].sum()
+            .rename(columns={"news_count": "count"})
+        )
+        profile["news_by_month"] = (
+            query_cells.groupby("timestamp", as_index=False)["news_count"].sum()
+            .rename(columns={"news_count": "count_of_news"})
+        )
+
+        # top 5 related keywords per month
+        monthly = (
+            cube[~cube["code"].isin(query_codes)]
+            .groupby(["timestamp", "code"], as_index=False)["mentions"].sum()
+            .sort_values(["timestamp", "mentions"], ascending=[True, False], kind="stable")
+            .groupby("timestamp").head(5)
+        )
+        profile["keywords_by_month"] = (
+            monthly.groupby("timestamp")["code"]
+            .agg(lambda codes: [self.vocabulary[code] for code in codes])
+            .rename("top5_keywords")
+            .reset_index()
+        )
+
+        profile["keywords"], quantiles = self._keywords(cube, query_codes, top_n, keys)
+        profile["all_sentiments"] = all_sentiments if all_sentiments is not None else quantiles
+        return profile
+
+    def keyword_detail(self, row_ids, topic, min_count=5, window=None):
+        # only the news that mention the topic at all
+        positions, _ = self._postings(topic)
+        row_ids = np.intersect1d(np.asarray(row_ids, dtype=np.int64), self.row_ids[positions])
+        if len(row_ids) == 0:
+            return None
+
+        keywords, _ = self._keywords(self._cube(row_ids), keys=[topic], min_count=min_count)
+        return keywords.get(topic)
+
+    def keywords(self, min_count=5):
+        # every keyword with its number of matching news
+        codes = np.repeat(np.arange(len(self.vocabulary)), np.diff(self.keyword_offsets))
+        doc_freq = np.bincount(codes[self.keyword_counts >= min_count], minlength=len(self.vocabulary))
+        return list(self.vocabulary), doc_freq
+
+    def top_topics(self, n, min_count=5):
+        # keywords with most matching news
+        _, doc_freq = self.keywords(min_count)
+        best = np.argsort(-doc_freq, kind="stable")[:n]
+        return [self.vocabulary[code] for code in best if doc_freq[code] > 0]
+
+    def batch_profiles(self, topics):
+        # everything is in memory already, no scan to share
+        for topic in topics:
+            yield topic, self.profile(self.lookup(topic), topic)
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+from paths import PARQUET_PATH
+from index import load_index, lookup_months, in_window_column, row_id_column
+from aggregation import query_profile, keyword_detail
+from batch import top_topics, batch_profiles
+
+# %% [markdown]
+# motor de consulta sobre Spark
+
+# %%
+
+# Lookups whose months are kept (a search's months follow its lookups)
+RECENT_LOOKUPS = 8
+
+class SparkEngine:
+    def __init__(self, parquet_path=PARQUET_PATH):
+        self.parquet_path = parquet_path
+        self.spark = SparkSession.builder \
+            .appName("News App") \
+            .config("spark.ui.enabled", "false") \
+            .getOrCreate()
+        self.index = load_index(self.spark, parquet_path)
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def articles(self, row_ids, window=None):
+        # the window prunes the month partitions, the row id ranges the row groups
+        return (
+            self.index["articles"]
+            .filter(in_window_column(window))
+            .filter(row_id_column(row_ids))
+        )
+
+    def updated(self):
+        # dataframes are lazy: listing the files again is the whole reload
+        return SparkEngine(self.parquet_path)
+
+    def corpus_stats(self):
+        articles = self.index["articles"]
+        return articles.count(), articles.agg(F.max("timestamp")).collect()[0][0]
+
+    def lookup(self, query, min_count=5, window=None):
+        row_ids, months = lookup_months(self.index, query, min_count, window)
+        with self._lock:
+            self._recent[(query, min_count, window)] = (row_ids, months)
+            self._recent.move_to_end((query, min_count, window))
+            while len(self._recent) > RECENT_LOOKUPS:
+                self._recent.popitem(last=False)
+        return row_ids.tolist()
+
+    def months(self, row_ids, window=None):
+        # month of each news, from the postings of the lookups that matched
+        # it; the articles are only read for row ids none of them has
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        months = np.zeros(len(row_ids), dtype=np.int64)
+        found = np.zeros(len(row_ids), dtype=bool)
+        with self._lock:
+            recent = list(self._recent.values())
+        for ids, stamps in reversed(recent):
+            missing = np.flatnonzero(~found)
+            if len(missing) == 0 or len(ids) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(ids, row_ids[missing]), len(ids) - 1)
+            hit = ids[positions] == row_ids[missing]
+            months[missing[hit]] = stamps[positions[hit]]
+            found[missing[hit]] = True
+
+        missing = np.flatnonzero(~found)
+        if len(missing) > 0:
+            scanned = dict(self.articles(row_ids[missing], window).select("row_id", "timestamp").collect())
+            months[missing] = [scanned[row_id] for row_id in row_ids[missing].tolist()]
+        return months
+
+    def profile(self, row_ids, query, top_n=200, keys=None, all_sentiments=None, window=None):
+        return query_profile(self.articles(row_ids, window), query,
+                             top_n=top_n, keys=keys, all_sentiments=all_sentiments)
+
+    def keyword_detail(self, row_ids, topic, window=None):
+        return keyword_detail(self.articles(row_ids, window), topic)
+
+    def keywords(self, min_count=5):
+        rows = (
+            self.index["postings"]
+            .filter(F.col("count") >= min_count)
+            .groupBy("keyword").count()
+            .collect()
+        )
+        return [row["keyword"] for row in rows], [row["count"] for row in rows]
+
+    def top_topics(self, n):
+        return top_topics(self.index, n)
+
+    def batch_profiles(self, topics):
+        return batch_profiles(self.index, topics)
@@ -2,216 +2,147 @@
 # carregar libraries
 
 # %%
-import matplotlib
-matplotlib.use('Agg')
-
-import networkx as nx
 import plotly.graph_objects as go
 import numpy as np
-import matplotlib.pyplot as plt
-import base64
-from io import BytesIO
 import json
-from itertools import islice
+import html
 
-def rgb_string_to_hex(rgb_string):
-    rgb_values = rgb_string.strip('rgb()').split(',')
-    rgb = tuple(int(value.strip()) for value in rgb_values)
-    return '#{:02X}{:02X}{:02X}'.format(rgb[0], rgb[1], rgb[2])
+from layout import force_layout, expand_layout
+from charts import year_charts
+from assets import PLOTLY_JS_URL
+from keywordtable import KeywordTable
 
 # %% [markdown]
 # tratar dados e definir intervalos do sentimento
+#
+# as palavras-chave chegam numa KeywordTable (colunas NumPy): quantis, top
+# n, tamanhos e cores dos nodes sao calculados de uma vez para todos
 
 # %%
 # Dependecie for: how many words and sentiment intervals
 
-def data_insights(data_in, globalVar):
+QUANTILES = {"q10": 0.1, "q30": 0.3, "q70": 0.7, "q90": 0.9}
 
-    sentiments = []
-    for word in data_in:
-        sentiments.append(data_in[word]["sentiment"])
+# weight of the whole keyword space in each sentiment interval
+WEIGHTS = {"q10": 0.4, "q30": 0.3, "q70": 0.3, "q90": 0.4}
 
-    globalVar["all_sentiments"] = {"q10": np.quantile(sentiments, 0.1),
-                               "q30": np.quantile(sentiments, 0.3),
-                               "q70": np.quantile(sentiments, 0.7),
-                               "q90": np.quantile(sentiments, 0.9)}
+SENTIMENT_CLASSES = [("muito negativo", "rgb(204, 0, 0)"),
+                     ("negativo", "rgb(239, 83, 80)"),
+                     ("neutro", "rgb(204, 204, 204)"),
+                     ("positivo", "rgb(102, 187, 106)"),
+                     ("muito positivo", "rgb(0, 200, 81)")]
 
-def data_filter(data_in, numero_de_palavras, globalVar):
+def data_insights(data_in, globalVar, all_sentiments=None):
+
+    # quantiles already computed over the whole keyword space
+    if all_sentiments is not None:
+        globalVar["all_sentiments"] = all_sentiments
+        return
 
-    # Filter the data
-    if numero_de_palavras >= len(data_in):
-        data = data_in
-    else:
-        data = dict(islice(sorted(data_in.items(), key=lambda item: item[1]["count"], reverse=True), numero_de_palavras))
+    quantiles = np.quantile(data_in.sentiments, list(QUANTILES.values()))
+    globalVar["all_sentiments"] = dict(zip(QUANTILES, quantiles))
+
+def data_filter(data_in, numero_de_palavras, globalVar):
 
-    # Dependecie for: sentiment intervals
-    sentiments2 = []
-    counts2 = []
-    for word in data:
-        sentiments2.append(data[word]["sentiment"])
-        counts2.append(data[word]["count"])
+    # Filter the data (rows of the most mentioned keywords)
+    rows = data_in.top(numero_de_palavras)
+    sentiments = data_in.sentiments[rows]
 
     # Set sentiment intervals
-    quantile10 = globalVar["all_sentiments"]["q10"]*0.4 + np.quantile(sentiments2, 0.1)*0.6
-    quantile30 = globalVar["all_sentiments"]["q30"]*0.3 + np.quantile(sentiments2, 0.3)*0.7
-    quantile70 = globalVar["all_sentiments"]["q70"]*0.3 + np.quantile(sentiments2, 0.7)*0.7
-    quantile90 = globalVar["all_sentiments"]["q90"]*0.4 + np.quantile(sentiments2, 0.9)*0.6
+    quantiles = np.quantile(sentiments, list(QUANTILES.values()))
+    globalVar["rows_filtered"] = rows
+    globalVar["sentiment_intervals"] = {
+        key: globalVar["all_sentiments"][key]*WEIGHTS[key] + quantile*(1 - WEIGHTS[key])
+        for key, quantile in zip(QUANTILES, quantiles)}
 
-    globalVar["data_filtered"] = data
-    globalVar["sentiment_intervals"] = {"q10": quantile10,
-                                        "q30": quantile30,
-                                        "q70": quantile70,
-                                        "q90": quantile90}
-    
-    globalVar["min_count"] = min(counts2)
+    globalVar["min_count"] = data_in.counts[rows].min()
 
 # %% [markdown]
 # criar a base do grafo
 
 # %%
 
-def initialize_graph(data, globalVar):
-
-    # Create the graph
-    G = nx.Graph()
-
-    #np.random.seed(21)
-    spread_x = 300
-    spread_y = 150
-    min_distance = 50
-
-    pos = {}
-    G.add_node("center")
-    pos["center"] = (0, 0)
+def initialize_graph(data, query, globalVar, layout=None):
 
-    # Add nodes to the graph with attributes and positions
-    for word, attributes in data.items():
-        G.add_node(word, **attributes)
+    # Node positions: seeded by the query (same topic, same graph), and
+    # the ones already in layout (e.g. cached with the keywords) are kept
+    pos = force_layout(data.keywords, query, fixed=layout)
+    if layout is not None:
+        layout.update(pos)
 
-        while True:
-            x = np.random.uniform(-spread_x, spread_x)
-            y = np.random.uniform(-spread_y, spread_y)
-
-            distance_from_center = np.linalg.norm([x, y])
-
-            if distance_from_center >= min_distance:
-                pos[word] = (x, y)
-                break
-
-    # Node positions
-    #pos = nx.spring_layout(G, seed=124348)
-    pos = nx.spring_layout(G, pos=pos, fixed=["center"], k=0.1, iterations=150, scale=1000, seed=21)
-
-    G.remove_node("center")
-    del pos["center"]
-
-    globalVar["G"] = G
+    globalVar["data_filtered"] = data
     globalVar["pos"] = pos
 
 # %% [markdown]
 # informacoes para cada node
+#
+# o grafo so leva a posicao, o nome, o tamanho e a cor de cada node; o
+# painel de um node (fontes, noticias, mencoes por ano) e pedido a
+# /grafo/no quando se clica nele
 
 # %%
-def node_info(node,
-              node_x, node_y,
-              node_text, node_form,
-              node_size, node_color,
-              node_hovertext, custom_data,
-              query, globalVar):
-    
-    G = globalVar["G"]
-        
-    # Node position
-    x, y = globalVar["pos"][node]
-    node_x.append(x)
-    node_y.append(y)
-
-    # Node text (name)
+def sentiment_classes(sentiments, globalVar):
+
+    # Index in SENTIMENT_CLASSES of each sentiment
+    intervals = globalVar["sentiment_intervals"]
+    sentiments = np.asarray(sentiments)
+    return np.select([sentiments <= intervals["q10"],
+                      sentiments <= intervals["q30"],
+                      sentiments < intervals["q70"],
+                      sentiments < intervals["q90"]],
+                     [0, 1, 2, 3], 4)
+
+def news_date(stamp):
+    # yyyy/mm of a yyyymm timestamp (or of an arquivo.pt url)
+    stamp = str(stamp).split("/")[5] if "/" in str(stamp) else str(stamp)
+    return stamp[:4] + "/" + stamp[4:6]
+
+def node_label(node):
+    # Node text (name), long names in two lines
     if " " in node:
         splitted_text = node.split(" ")
         mid_text = len(splitted_text)//2
-        node_text.append(' '.join(splitted_text[:mid_text]) + '<br>' + ' '.join(splitted_text[mid_text:]))
-    else:
-        node_text.append(node)
+        return ' '.join(splitted_text[:mid_text]) + '<br>' + ' '.join(splitted_text[mid_text:])
+    return node
 
-    # Node form
-    node_form.append("circle")
+def node_panel(data, node, query, globalVar):
+    # everything the info panel shows about a node
 
-    # Node size
-    node_size.append(((np.log(G.nodes[node]["count"]/globalVar["min_count"]))*3)**1.5 + 50)
-    
-    # Node color
-    sentiment = G.nodes[node]["sentiment"]
-    if sentiment <= globalVar["sentiment_intervals"]["q10"]:
-        sentiment_class = "muito negativo"
-        color = "rgb(204, 0, 0)"
-        node_color.append(color)
-    elif sentiment <= globalVar["sentiment_intervals"]["q30"]:
-        sentiment_class = "negativo"
-        color = "rgb(239, 83, 80)"
-        node_color.append(color)
-    elif sentiment < globalVar["sentiment_intervals"]["q70"]:
-        sentiment_class = "neutro"
-        color = "rgb(204, 204, 204)"
-        node_color.append(color)
-    elif sentiment < globalVar["sentiment_intervals"]["q90"]:
-        sentiment_class = "positivo"
-        color = "rgb(102, 187, 106)"
-        node_color.append(color)
-    else:
-        sentiment_class = "muito positivo"
-        color = "rgb(0, 200, 81)"
-        node_color.append(color)
-
-    # Dependecie for: Node hovertext (last said) and Custom data (websites and plot)
-    websites = sorted(G.nodes[node]["news"], reverse=True)
-    first_website = websites[-1].split("/")
-    first_website_date = first_website[5][:4] + "/" + first_website[5][4:6]
-    last_website = websites[0].split("/")
-    last_website_date = last_website[5][:4] + "/" + last_website[5][4:6]
-
-    # Node hovertext
-    node_hovertext.append(
-        f"""Tópico: {node}
-        <br>Menções: {int(G.nodes[node]['count'])}
-        <br>Último registo: {last_website_date}"""
-    )
+    sentiment, color = SENTIMENT_CLASSES[int(sentiment_classes([data.sentiments[data.row(node)]], globalVar)[0])]
+    count = int(data.counts[data.row(node)])
+
+    # Dependecie for: websites and plot
+    websites = sorted(data.news(node), reverse=True)
+    first_website_date = news_date(websites[-1])
+    last_website_date = news_date(websites[0])
 
-    # Dependecie for: Custom data (websites)
+    # Dependecie for: websites
     websites_data = ""
     for website in websites:
         website_ = website.split("/")
-        websites_data += f"<p><a href='{website}' target='_blank'>{website_[5][:4]+'/'+website_[5][4:6]+' - '+ '/'.join(website_[6:])}</a></p>"
-
-    # Dependecie for: Custom data (plot)
-    times_said_by_year = {str(k): 0 for k in range(int(first_website_date[:4]),
-                                            int(last_website_date[:4])+1)}
-    for key in G.nodes[node]["date"].keys():
-        times_said_by_year[str(key)[:4]] += int(G.nodes[node]["date"][key])
-    plt.figure(figsize=(6, 4))
-    plt.bar(times_said_by_year.keys(), times_said_by_year.values(), color=rgb_string_to_hex(color))
-    plt.xlabel('Ano')
-    plt.ylabel('Número de Menções')
-    plt.grid(axis='y', alpha=0.2)
-    plt.tight_layout()
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png', transparent=True)
-    plt.close() 
-    buffer.seek(0)
-    img_str = base64.b64encode(buffer.read()).decode('utf-8')
-
-    # Dependecie for: Custom data (source)
-    source = G.nodes[node]["source"]
+        websites_data += f"<p><a href='{website}' target='_blank'>{news_date(website)+' - '+ '/'.join(website_[6:])}</a></p>"
+
+    # Dependecie for: plot
+    span = (int(first_website_date[:4]), int(last_website_date[:4]))
+    chart = year_charts(data.take([data.row(node)]), [span], [color])[0]
+    months, mentions = data.dates(node)
+    years, by_year = np.unique(months // 100, return_inverse=True)
+    times_said_by_year = {str(k): 0 for k in range(span[0], span[1]+1)}
+    for year, total in zip(years.tolist(), np.bincount(by_year, mentions).tolist()):
+        if str(year) in times_said_by_year:
+            times_said_by_year[str(year)] = int(total)
+
+    # Dependecie for: source
+    source = data.source_counts_of(node)
     source_data = ""
     for key in source.keys():
-        if source[key] is not None:
-            source_data += f"<li>{key}: {int(source[key])}</li>"
+        source_data += f"<li>{key}: {source[key]}</li>"
         
-    # Node custom data
-    custom_data.append(f"""
+    # Panel html
+    info_html = f"""
         <h2 style="text-align: center;">Associação entre<br>{query} e {node}</h2>
-        <p>Menções: {int(G.nodes[node]['count'])}</p>
-        <p>Sentimento: {sentiment_class}</p>
+        <p>Menções: {count}</p>
+        <p>Sentimento: {sentiment}</p>
         <p>Fontes:</p>
         <ul>
         {source_data}
@@ -224,55 +155,98 @@ def node_info(node,
         <div id="website-urls">
             {websites_data}
         </div>
-        <img src="data:image/png;base64,{img_str}" alt="Bar Plot" style="width:100%; height:auto;">
-        """)
+        <div class="year-chart">{chart}</div>
+        """
+
+    return {"no": node,
+            "mencoes": count,
+            "sentimento": sentiment,
+            "cor": color,
+            "fontes": source,
+            "noticias": websites,
+            "por_ano": times_said_by_year,
+            "html": info_html}
     
-def populate_nodes(G, query, globalVar):
-
-    # Lists for node info
-    node_x, node_y = [0], [0]
-    node_text, node_form = [f"<b>{query}</b>"], ["square"]
-    node_size, node_color= [0], ["rgb(217, 238, 252)"]
-    node_hovertext, custom_data = ["Explora os tópicos ao clicares neles!"], [""]
-
-    # Populate node information
-    for node in G.nodes:
-        node_info(node, #has all the information
-                  node_x,
-                  node_y,
-                  node_text,
-                  node_form,
-                  node_size,
-                  node_color,
-                  node_hovertext,
-                  custom_data,
-                  query,
-                  globalVar)
-    
-    globalVar["node_x"] = node_x
-    globalVar["node_y"] = node_y
-    globalVar["node_text"] = node_text
-    globalVar["node_form"] = node_form
-    globalVar["node_size"] = node_size
-    globalVar["node_color"] = node_color
-    globalVar["node_hovertext"] = node_hovertext
-    globalVar["custom_data"] = custom_data
+def populate_nodes(data, query, globalVar):
+
+    # Node position
+    pos = np.array([globalVar["pos"][node] for node in data.keywords]).reshape(-1, 2)
+
+    # Node size (nodes below the graph's smallest get the base size)
+    sizes = ((np.maximum(np.log(data.counts/globalVar["min_count"]), 0))*3)**1.5 + 50
+
+    # Node color
+    colors = np.array([color for _, color in SENTIMENT_CLASSES])[sentiment_classes(data.sentiments, globalVar)]
+
+    # Node hovertext (last news)
+    _, last_news = data.news_range()
+    hovertexts = [f"""Tópico: {node}
+        <br>Menções: {count}
+        <br>Último registo: {news_date(last)}"""
+                  for node, count, last in zip(data.keywords, data.counts.tolist(), last_news.tolist())]
+
+    # Lists for node info, the query's node first
+    globalVar["node_x"] = [0] + pos[:, 0].tolist()
+    globalVar["node_y"] = [0] + pos[:, 1].tolist()
+    globalVar["node_text"] = [f"<b>{query}</b>"] + [node_label(node) for node in data.keywords]
+    globalVar["node_form"] = ["square"] + ["circle"] * len(data)
+    globalVar["node_size"] = [0] + sizes.tolist()
+    globalVar["node_color"] = ["rgb(217, 238, 252)"] + colors.tolist()
+    globalVar["node_hovertext"] = ["Explora os tópicos ao clicares neles!"] + hovertexts
+
+    # Node custom data (the panel is fetched by name)
+    globalVar["custom_data"] = [""] + list(data.keywords)
+
+def populate_edges(edges, globalVar):
+
+    # Edge segments, separated by None (one trace for every edge)
+    pos = globalVar["pos"]
+    edges = [(a, b) for a, b, _ in edges if a in pos and b in pos]
+    globalVar["edge_x"] = [x for a, b in edges for x in (pos[a][0], pos[b][0], None)]
+    globalVar["edge_y"] = [y for a, b in edges for y in (pos[a][1], pos[b][1], None)]
 
 # %% [markdown]
 # gerar grafo e algumas definicoes
+#
+# acima de GRAPH_NODES topicos o grafo e desenhado em WebGL (Scattergl),
+# com nodes mais pequenos e so os nomes dos LABELS maiores nodes visiveis
+# (escolhidos de novo a cada zoom)
+#
+# "Mostrar mais" junta ao grafo desenhado os GRAPH_MORE topicos seguintes,
+# pedidos a /grafo/mais: so os novos nodes sao posicionados e enviados
 
 # %%
+GRAPH_NODES = 125
+GRAPH_MORE = 25
+LABELS = 60
+WEBGL_SIZE = 0.4
+
 # Create the Plotly figure
-def create_graph(globalVar):
+def create_graph(globalVar, webgl=False):
 
     fig = go.Figure()
 
+    # Large graphs: WebGL markers, and only some labels (see lod_html)
+    Trace = go.Scattergl if webgl else go.Scatter
+
+    # Draw edges (topics mentioned together), under the nodes
+    if globalVar.get("edge_x"):
+        fig.add_trace(
+            Trace(
+                x=globalVar["edge_x"],
+                y=globalVar["edge_y"],
+                mode="lines",
+                line=dict(color="rgba(48, 62, 92, 0.15)", width=1),
+                hoverinfo="skip"
+            )
+        )
+
     # Draw nodes
     fig.add_trace(
-        go.Scatter(
+        Trace(
             x=globalVar["node_x"],
             y=globalVar["node_y"],
-            mode="markers+text",
+            mode="markers" if webgl else "markers+text",
             text=globalVar["node_text"],
             hovertext=globalVar["node_hovertext"],
             marker=dict(
@@ -290,6 +264,18 @@ def create_graph(globalVar):
         )
     )
 
+    # Draw labels of the biggest nodes (replaced on zoom by lod_html)
+    if webgl:
+        fig.add_trace(
+            go.Scatter(
+                x=globalVar["node_x"][:LABELS],
+                y=globalVar["node_y"][:LABELS],
+                mode="text",
+                text=globalVar["node_text"][:LABELS],
+                hoverinfo="skip"
+            )
+        )
+
     # Update the layout
     fig.update_layout(
         showlegend=False,
@@ -303,8 +289,8 @@ def create_graph(globalVar):
         #)
     )
 
-    # Generate the base HTML with graph
-    html_code = fig.to_html(include_plotlyjs='inline',
+    # Generate the base HTML with graph (plotly.js is a cached static file)
+    html_code = fig.to_html(include_plotlyjs=PLOTLY_JS_URL,
                             full_html=True,
                             config={
                                 'displaylogo': False,
@@ -408,9 +394,27 @@ additional_html = """
     .url-navigation button:hover {
         background-color: #5a6268;
     }
+    #show-more {
+        position: absolute;
+        left: 10px;
+        bottom: 10px;
+        z-index: 1;
+        border: none;
+        border-radius: 2px;
+        padding: 6px 10px;
+        cursor: pointer;
+        background-color: rgb(48, 62, 92);
+        color: white;
+    }
+    #show-more:disabled {
+        opacity: 0.5;
+        cursor: default;
+    }
 </style>
 
-<div id="info-panel">
+<button id="show-more" onclick="showMore()">Mostrar mais</button>
+
+<div id="info-panel" data-topico="{query}" data-nos="{nodes}" data-escala="{scale}">
     <button class="close-button" onclick="closePanel()">Fechar</button>
     <p id="node-info">Escolha um nó para ver detalhes.</p>
 </div>
@@ -453,6 +457,46 @@ additional_html = """
         document.getElementById("current-url").textContent = `Notícia ${currentUrlIndex + 1}/${urls.length}`;
     }
 
+    // Append the next topics to the graph (the drawn nodes stay in place)
+    function showMore() {
+        var plotDiv = document.querySelector('.plotly-graph-div');
+        var panelData = document.getElementById('info-panel').dataset;
+        var button = document.getElementById('show-more');
+        button.disabled = true;
+        fetch('/grafo/mais?topico=' + encodeURIComponent(panelData.topico) + '&nos=' + panelData.nos
+              + '&k={more}')
+            .then(response => response.ok ? response.json() : Promise.reject(response.status))
+            .then(more => {
+                // the larger graph's topics are still being aggregated: ask again
+                if (more.estado === 'a calcular') {
+                    setTimeout(showMore, 2000);
+                    return;
+                }
+                var nodes = plotDiv.data.findIndex(trace => trace.customdata); // the node trace
+                var scale = parseFloat(panelData.escala);
+                if (more.x.length > 0) {
+                    Plotly.extendTraces(plotDiv, {
+                        x: [more.x],
+                        y: [more.y],
+                        text: [more.text],
+                        hovertext: [more.hovertext],
+                        customdata: [more.customdata],
+                        'marker.size': [more.size.map(size => size * scale)],
+                        'marker.color': [more.color],
+                        'marker.symbol': [more.x.map(() => 'circle')]
+                    }, [nodes]);
+                }
+
+                // the node panels are now asked for the larger graph
+                panelData.nos = more.nos;
+                button.disabled = more.fim;
+            })
+            .catch(error => {
+                button.disabled = false;
+                console.error("An error occurred:", error);
+            });
+    }
+
     // Function to initialize the URL display for a new node
     function initializeUrls() {
         const urls = document.querySelectorAll("#website-urls p");
@@ -485,16 +529,28 @@ additional_html = """
                         return;
                     }
 
-                    document.getElementById('node-info').innerHTML = customData; // Use custom data for the panel
-
-                    // Reset the URL index when a new node is clicked
-                    currentUrlIndex = 0; // Reset to first URL
-                    try {
-                        initializeUrls(); // Reinitialize the URLs
-                    } catch (error) {
-                        // Code to handle the error
-                        console.error("An error occurred:", error);
-                    }
+                    // Fetch the node's panel (only the clicked nodes are ever built)
+                    var panelInfo = document.getElementById('node-info');
+                    var panelData = document.getElementById('info-panel').dataset;
+                    panelInfo.innerHTML = 'A carregar...';
+                    fetch('/grafo/no?topico=' + encodeURIComponent(panelData.topico) + '&no=' + encodeURIComponent(customData)
+                          + '&nos=' + panelData.nos)
+                        .then(response => response.ok ? response.json() : Promise.reject(response.status))
+                        .then(node => {
+                            if (node.estado === 'a calcular') {
+                                panelInfo.innerHTML = 'A calcular os tópicos deste grafo, tente de novo dentro de momentos.';
+                                return;
+                            }
+                            panelInfo.innerHTML = node.html;
+
+                            // Reset the URL index when a new node is clicked
+                            currentUrlIndex = 0; // Reset to first URL
+                            initializeUrls(); // Reinitialize the URLs
+                        })
+                        .catch(error => {
+                            panelInfo.innerHTML = 'Não foi possível carregar este tópico.';
+                            console.error("An error occurred:", error);
+                        });
 
                     // Determine mouse click position for panel placement
                     var mouseX = data.event.clientX; 
@@ -520,12 +576,53 @@ additional_html = """
 </script>
 """
 
+# Level of detail for WebGL graphs: label the biggest nodes in view
+lod_html = """
+<script>
+    document.addEventListener('DOMContentLoaded', function() {
+        var plotDiv = document.querySelector('.plotly-graph-div');
+        if (!plotDiv) {
+            return;
+        }
+        var labels = plotDiv.data.length - 1; // last trace: labels
+        var nodes = labels - 1; // nodes, sorted by mentions (the query first)
+
+        function updateLabels() {
+            var xRange = plotDiv._fullLayout.xaxis.range;
+            var yRange = plotDiv._fullLayout.yaxis.range;
+            var trace = plotDiv.data[nodes];
+            var x = [], y = [], text = [];
+            for (var i = 0; i < trace.x.length && x.length < {labels}; i++) {
+                if (trace.x[i] >= xRange[0] && trace.x[i] <= xRange[1]
+                        && trace.y[i] >= yRange[0] && trace.y[i] <= yRange[1]) {
+                    x.push(trace.x[i]);
+                    y.push(trace.y[i]);
+                    text.push(trace.text[i]);
+                }
+            }
+            Plotly.restyle(plotDiv, {x: [x], y: [y], text: [text]}, [labels]);
+        }
+
+        plotDiv.on('plotly_relayout', updateLabels);
+    });
+</script>
+"""
+
+def panel_html(query, nodes=GRAPH_NODES, webgl=False):
+    # the panel asks /grafo/no for the nodes of this query's graph
+    panel = (additional_html.replace("{query}", html.escape(query, quote=True)).replace("{nodes}", str(nodes))
+             .replace("{scale}", str(WEBGL_SIZE if webgl else 1)).replace("{more}", str(GRAPH_MORE)))
+    if webgl:
+        panel += lod_html.replace("{labels}", str(LABELS))
+    return panel
+
 # %% [markdown]
 # funcao geral
 # %%
 
-def create_keyword_graph(data_in, numero_de_palavras, query):
+def create_keyword_graph(data_in, numero_de_palavras, query, all_sentiments=None, layout=None, edges=None):
     globalVar = {}
+    webgl = numero_de_palavras > GRAPH_NODES
 
     # no data available
     if len(data_in) == 0:
@@ -534,24 +631,87 @@ def create_keyword_graph(data_in, numero_de_palavras, query):
         globalVar["node_size"], globalVar["node_color"] = [0], ["rgb(217, 238, 252)"]
         globalVar["node_hovertext"], globalVar["custom_data"] = ["Não foram encontrados tópicos relevantes..."], [""]
         html_code = create_graph(globalVar)
-        final_html = combine_graph_html(html_code, additional_html)
+        final_html = combine_graph_html(html_code, panel_html(query))
         return final_html
     
     # data available
-    if query in data_in:
-        del data_in[query]
-    data_insights(data_in, globalVar)
+    data_in = KeywordTable.from_keywords(data_in).without(query)
+    data_insights(data_in, globalVar, all_sentiments)
     data_filter(data_in, numero_de_palavras, globalVar)
-    initialize_graph(globalVar["data_filtered"], globalVar)
-    populate_nodes(globalVar["G"], query, globalVar)
-    html_code = create_graph(globalVar)
-    final_html = combine_graph_html(html_code, additional_html)
+    initialize_graph(data_in.take(globalVar["rows_filtered"]), query, globalVar, layout)
+    populate_nodes(globalVar["data_filtered"], query, globalVar)
+    if webgl:
+        globalVar["node_size"] = [size * WEBGL_SIZE for size in globalVar["node_size"]]
+    if edges:
+        populate_edges(edges, globalVar)
+    html_code = create_graph(globalVar, webgl)
+    final_html = combine_graph_html(html_code, panel_html(query, numero_de_palavras, webgl))
 
     #with open("graph_galptest.html", 'w') as f:
     #    f.write(final_html)
 
     return final_html
 
+def node_detail(data_in, numero_de_palavras, query, node, all_sentiments=None):
+    # panel of one node of create_keyword_graph's graph, None if the node
+    # is not in it (same top keywords and sentiment intervals); only the
+    # counts and sentiments are read, and the node's own record (a
+    # KeywordFile is not decoded)
+    if not hasattr(data_in, "counts"):
+        data_in = KeywordTable.from_keywords(data_in)
+    if node not in data_in or node == query:
+        return None
+
+    globalVar = {}
+    keep = np.array([key != query for key in data_in], dtype=bool)
+    summary = KeywordTable.columns([key for key in data_in if key != query],
+                                   np.asarray(data_in.counts)[keep], np.asarray(data_in.sentiments)[keep])
+    data_insights(summary, globalVar, all_sentiments)
+    data_filter(summary, numero_de_palavras, globalVar)
+    if node not in {summary.keywords[i] for i in globalVar["rows_filtered"]}:
+        return None
+
+    return node_panel(KeywordTable.from_keywords({node: data_in[node]}), node, query, globalVar)
+
+def expand_graph(data_in, shown, numero_de_palavras, query, all_sentiments=None, layout=None):
+    # "mostrar mais": the nodes a graph of `shown` topics gets when it grows
+    # to numero_de_palavras, as lists to append to its node trace; only the
+    # new nodes are placed (around the drawn ones, kept in layout)
+    globalVar = {}
+    layout = {} if layout is None else layout
+    data_in = KeywordTable.from_keywords(data_in).without(query)
+    if len(data_in) == 0:
+        return {"nos": 0, "fim": True, "x": [], "y": [], "text": [], "hovertext": [],
+                "size": [], "color": [], "customdata": []}
+    data_insights(data_in, globalVar, all_sentiments)
+    data_filter(data_in, numero_de_palavras, globalVar)
+    rows = globalVar["rows_filtered"]
+    drawn, new = rows[:shown], data_in.take(rows[shown:])
+
+    # Positions: the ones known from a previous graph, then the rest
+    fixed = {data_in.keywords[i]: layout[data_in.keywords[i]] for i in drawn.tolist()
+             if data_in.keywords[i] in layout}
+    pos = {node: layout[node] for node in new.keywords if node in layout}
+    pos.update(expand_layout(fixed, [node for node in new.keywords if node not in pos], query))
+    layout.update(pos)
+
+    # Sizes relative to the drawn graph, colors (like the panels) to the larger one
+    globalVar["pos"] = pos
+    if len(drawn) > 0:
+        globalVar["min_count"] = data_in.counts[drawn].min()
+    populate_nodes(new, query, globalVar)
+
+    # (without the query's node, already drawn)
+    return {"nos": len(rows),
+            "fim": len(rows) < numero_de_palavras or len(rows) <= shown,
+            "x": globalVar["node_x"][1:],
+            "y": globalVar["node_y"][1:],
+            "text": globalVar["node_text"][1:],
+            "hovertext": globalVar["node_hovertext"][1:],
+            "size": globalVar["node_size"][1:],
+            "color": globalVar["node_color"][1:],
+            "customdata": globalVar["custom_data"][1:]}
+
 #%%
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+from pyspark.sql import functions as F
+from functools import reduce
+import operator
+import os
+
+import numpy as np
+
+from ingest import PARQUET_PATH, ingest
+
+# %% [markdown]
+# indice invertido: palavra-chave -> (row_id, contagem)
+
+# %%
+
+def load_index(spark, parquet_path=PARQUET_PATH):
+    # converted once by ingest.py, reused by every later run
+    if not os.path.exists(f"{parquet_path}/keywords"):
+        ingest(spark, parquet_path=parquet_path)
+
+    return {"articles": spark.read.parquet(f"{parquet_path}/news"),
+            "postings": spark.read.parquet(f"{parquet_path}/keywords")}
+
+def in_window_column(window):
+    # months (yyyymm) inside the window, either end open
+    condition = F.lit(True)
+    if window is not None and window[0] is not None:
+        condition &= F.col("timestamp") >= window[0]
+    if window is not None and window[1] is not None:
+        condition &= F.col("timestamp") <= window[1]
+    return condition
+
+def row_id_ranges(row_ids, max_ranges=64):
+    # sorted row ids as at most max_ranges (first, last) ranges, split at
+    # the largest gaps between them
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    if len(row_ids) == 0:
+        return []
+    gaps = np.diff(row_ids)
+    splits = np.sort(np.argsort(-gaps, kind="stable")[:max_ranges - 1])
+    splits = splits[gaps[splits] > 1]
+    starts = np.concatenate([[0], splits + 1])
+    ends = np.concatenate([splits, [len(row_ids) - 1]])
+    return list(zip(row_ids[starts].tolist(), row_ids[ends].tolist()))
+
+def row_id_column(row_ids, max_ranges=64):
+    # the articles with these row ids: a long isin only reaches parquet as
+    # one min/max range, the ranges are pushed down as they are, so the row
+    # groups (sorted by row id in each month) between them are skipped
+    ranges = row_id_ranges(row_ids, max_ranges)
+    if not ranges:
+        return F.lit(False)
+    in_ranges = reduce(operator.or_, [F.col("row_id").between(first, last) for first, last in ranges])
+    return in_ranges & F.col("row_id").isin([int(row_id) for row_id in row_ids])
+
+def lookup_months(index, query, min_count=5, window=None):
+    # sorted row ids of the articles mentioning the query at least min_count
+    # times (within the window, if any), and the month of each
+    rows = (
+        index["postings"]
+        .filter((F.col("keyword") == query) & (F.col("count") >= min_count) & in_window_column(window))
+        .select("row_id", "timestamp")
+        .collect()
+    )
+    rows = sorted((row["row_id"], row["timestamp"]) for row in rows)
+    return (np.array([row_id for row_id, _ in rows], dtype=np.int64),
+            np.array([month for _, month in rows], dtype=np.int64))
+
+def lookup(index, query, min_count=5, window=None):
+    return lookup_months(index, query, min_count, window)[0].tolist()
+
+def filter_news(index, query, min_count=5, window=None):
+    row_ids = lookup(index, query, min_count, window)
+
+    # fetch only the matching articles (partitions outside the window are
+    # never listed, row groups outside the postings' row id ranges are
+    # skipped by the parquet reader)
+    return index["articles"].filter(in_window_column(window)).filter(row_id_column(row_ids))
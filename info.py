@@ -1,6 +1,3 @@
-from pyspark.sql import functions as F
-from pyspark.sql.window import Window
-from pyspark.sql.functions import collect_list
 import numpy as np
 import pandas as pd
 import plotly.io as pio
@@ -14,9 +11,8 @@ from io import BytesIO
 
 #%%
 
-def pie_newsSources(df_with_query):
-    # Group by the column and count the values
-    value_counts_df = df_with_query.groupBy('source').count().toPandas()
+def pie_newsSources(value_counts_df):
+    # News count per source (from the query profile)
 
     # Extract labels and values directly
     labels = value_counts_df['source']
@@ -42,11 +38,11 @@ def pie_newsSources(df_with_query):
         margin=dict(t=25, b=25, l=0, r=0)
     )
 
-    return pio.to_html(fig, full_html=False, config={'displayModeBar': False})
+    return pio.to_html(fig, full_html=False, include_plotlyjs=False, config={'displayModeBar': False})
 
 #%%
 
-def timeseries_news(df_with_query, query):
+def timeseries_news(news_by_month, keywords_by_month):
     traducao_meses = {
         "January": "janeiro", "February": "fevereiro", "March": "março",
         "April": "abril", "May": "maio", "June": "junho",
@@ -54,26 +50,6 @@ def timeseries_news(df_with_query, query):
         "October": "outubro", "November": "novembro", "December": "dezembro"
     }
 
-    news_by_month = (
-        df_with_query
-        .groupBy('timestamp')
-        .agg(F.count('archive').alias('count_of_news'))
-        .toPandas()
-    )
-
-    keywords_by_month = (
-        df_with_query
-        .select('*', F.explode('keywords'))
-        .groupBy("timestamp", "key")
-        .agg(F.sum("value").alias("key_mentions"))
-        .filter(F.col("key") != query)
-        .withColumn("rank", F.row_number().over(Window.partitionBy("timestamp").orderBy(F.desc("key_mentions"))))
-        .filter(F.col("rank") <= 5)
-        .groupBy("timestamp")
-        .agg(collect_list("key").alias("top5_keywords"))
-        .toPandas()
-    )
-
     news_history = news_by_month.merge(keywords_by_month, on="timestamp", how="inner")
     news_history["timestamp"] = pd.to_datetime(news_history["timestamp"].astype(str), format='%Y%m')
 
@@ -136,7 +112,7 @@ def timeseries_news(df_with_query, query):
 
     fig.update_xaxes(tickformat="%Y-%m")
 
-    return pio.to_html(fig, full_html=False, config={'displayModeBar': False}), news_by_month
+    return pio.to_html(fig, full_html=False, include_plotlyjs=False, config={'displayModeBar': False}), news_by_month
 
 #%%
 
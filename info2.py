@@ -3,6 +3,11 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.io as pio
 
+from assets import PLOTLY_JS_URL
+
+# %% [markdown]
+# relacao entre a pesquisa e um topico (keywords e uma KeywordTable)
+
 # %%
 
 def ts_topicrelation(news_by_month, keywords, search_topic, query):
@@ -26,8 +31,9 @@ def ts_topicrelation(news_by_month, keywords, search_topic, query):
     news_by_monthc["timestamp"] = pd.to_datetime(news_by_monthc["timestamp"].astype(str), format='%Y%m')
 
     # number of mentions of the specific keyword
-    specific_keyword = pd.DataFrame(list(keywords[search_topic]["date"].items()), columns=["date", "count_specific_keyword"])
-    specific_keyword["date"] = pd.to_datetime(specific_keyword["date"], format="%Y%m")
+    months, mentions = keywords.dates(search_topic)
+    specific_keyword = pd.DataFrame({"date": months, "count_specific_keyword": mentions})
+    specific_keyword["date"] = pd.to_datetime(specific_keyword["date"].astype(str), format="%Y%m")
 
     # merge the two dataframes
     news_history = news_by_monthc.merge(specific_keyword, left_on="timestamp", right_on="date", how="left")
@@ -99,13 +105,13 @@ def ts_topicrelation(news_by_month, keywords, search_topic, query):
     fig.update_xaxes(tickformat="%Y-%m")
 
     #fig.show(config={'displayModeBar': False})
-    return pio.to_html(fig, full_html=False, config={'displayModeBar': False})
+    return pio.to_html(fig, full_html=False, include_plotlyjs=False, config={'displayModeBar': False})
 
 # %%
 
 def sources_topicrelation(keywords, search_topic):
 
-    sources = keywords[search_topic]['source']
+    sources = keywords.source_counts_of(search_topic)
 
     labels = list(sources.keys())
     values = list(sources.values())
@@ -132,7 +138,7 @@ def sources_topicrelation(keywords, search_topic):
         autosize=True
     )
 
-    return fig.to_html(full_html=True, config={'displayModeBar': False})
+    return fig.to_html(full_html=True, include_plotlyjs=PLOTLY_JS_URL, config={'displayModeBar': False})
 
 # %%
 
@@ -163,7 +169,7 @@ def news_topicrelation(keywords, search_topic):
     divs = {}
     titles = set()
 
-    for url in keywords[search_topic]["news"]:
+    for url in keywords.news(search_topic):
         link_content = url.split("/")
 
         # set title and verify if it is repeated
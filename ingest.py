@@ -0,0 +1,164 @@
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.types import *
+import argparse
+import os
+import shutil
+import sys
+import uuid
+
+from paths import NEWS_PATH, PARQUET_PATH
+from manifest import MANIFEST, source_files, read_manifest, write_manifest, write_update
+
+# %% [markdown]
+# converter o json das noticias para parquet
+
+# %%
+
+# Define the data schema
+schema = StructType([
+    StructField("timestamp", IntegerType(), True),
+    StructField("source", StringType(), True),
+    StructField("archive", StringType(), True),
+    StructField("id", IntegerType(), True),
+    StructField("probability", FloatType(), True),
+    StructField("keywords", MapType(StringType(), IntegerType()), True),
+    StructField("sentiment", FloatType(), True)
+])
+
+def write_news(news, parquet_path, mode):
+    # news table: one row per article with a stable row id,
+    # partitioned by month so time filters only read their partitions
+    (
+        news
+        .repartition("timestamp")
+        .sortWithinPartitions("row_id")
+        .write.mode(mode)
+        .partitionBy("timestamp")
+        .parquet(f"{parquet_path}/news")
+    )
+
+def write_keywords(news, parquet_path, mode):
+    # keyword table: one row per (article, keyword), range partitioned and
+    # sorted by keyword so a lookup only reads the row groups holding it
+    keywords = news.select(F.col("row_id"),
+                           "timestamp",
+                           "source",
+                           F.explode("keywords").alias("keyword", "count"),
+                           "sentiment")
+    (
+        keywords
+        .repartitionByRange("keyword")
+        .sortWithinPartitions("keyword", "row_id")
+        .write.mode(mode)
+        .parquet(f"{parquet_path}/keywords")
+    )
+    return keywords
+
+def news_stats(news):
+    row = news.agg(F.count(F.lit(1)).alias("news"),
+                   F.max("timestamp").alias("last_news"),
+                   F.max("row_id").alias("max_row_id")).collect()[0]
+    return row["news"], row["last_news"], row["max_row_id"]
+
+def ingest(spark, news_path=NEWS_PATH, parquet_path=PARQUET_PATH):
+    files = source_files(news_path)
+    news = (
+        spark.read.format("json").schema(schema).load(news_path)
+        .withColumn("row_id", F.monotonically_increasing_id())
+    )
+    write_news(news, parquet_path, "overwrite")
+    write_keywords(spark.read.parquet(f"{parquet_path}/news"), parquet_path, "overwrite")
+
+    # a new dataset: every cached search of the previous one is stale
+    shutil.rmtree(f"{parquet_path}/updates", ignore_errors=True)
+    count, last_news, max_row_id = news_stats(spark.read.parquet(f"{parquet_path}/news"))
+    write_manifest(parquet_path, {"dataset": uuid.uuid4().hex,
+                                  "generation": 0,
+                                  "files": files,
+                                  "news": count,
+                                  "last_news": last_news,
+                                  "next_row_id": max_row_id + 1})
+
+def ingest_new(spark, news_path=NEWS_PATH, parquet_path=PARQUET_PATH, min_count=5):
+    # append the json files added since the last conversion, without reading
+    # the older ones; returns the new keyword rows (cached) and the updated
+    # manifest, which the caller writes once the derived indexes are updated
+    # (None if nothing is new)
+    manifest = read_manifest(parquet_path)
+    if manifest is None:
+        raise FileNotFoundError(f"{parquet_path}/{MANIFEST} not found, run a full ingest first")
+
+    files = source_files(news_path)
+    changed = [path for path in manifest["files"] if path in files and files[path] != manifest["files"][path]]
+    if changed:
+        raise ValueError(f"{len(changed)} converted files were rewritten ({changed[0]}, ...), run a full ingest")
+    new = sorted(path for path in files if path not in manifest["files"])
+    if not new:
+        return None
+
+    # row ids continue after the last converted article
+    news = (
+        spark.read.format("json").schema(schema).load([os.path.join(news_path, path) for path in new])
+        .withColumn("row_id", F.monotonically_increasing_id() + manifest["next_row_id"])
+        .cache()
+    )
+    write_news(news, parquet_path, "append")
+    keywords = write_keywords(news, parquet_path, "append")
+
+    # topics whose results change: the ones the new articles match
+    touched = [row["keyword"] for row in
+               keywords.filter(F.col("count") >= min_count).select("keyword").distinct().collect()]
+    count, last_news, max_row_id = news_stats(news)
+    generation = manifest["generation"] + 1
+    write_update(parquet_path, generation, touched)
+
+    return keywords, {**manifest,
+                      "generation": generation,
+                      "files": {**manifest["files"], **{path: files[path] for path in new}},
+                      "news": manifest["news"] + count,
+                      "last_news": max(manifest["last_news"], last_news),
+                      "next_row_id": max_row_id + 1}
+
+def update(spark, news_path=NEWS_PATH, parquet_path=PARQUET_PATH, cache_directory="cache"):
+    # incremental update: new articles, cooccurrence matrix, manifest (the
+    # running app reloads when it changes) and the cached searches they affect
+    from cooccurrence import load_cooccurrence, update_cooccurrence
+    from cache import QueryCache
+    from manifest import updated_keywords
+
+    ingested = ingest_new(spark, news_path, parquet_path)
+    if ingested is None:
+        return None
+    keywords, manifest = ingested
+
+    if load_cooccurrence() is not None:
+        update_cooccurrence(spark, keywords)
+    write_manifest(parquet_path, manifest)
+    spark.catalog.clearCache()
+
+    touched = updated_keywords(parquet_path, manifest["generation"] - 1, manifest["generation"])
+    QueryCache(cache_directory, manifest["dataset"]).invalidate(touched)
+    return manifest
+
+# %%
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converter as notícias para parquet")
+    parser.add_argument("news_path", nargs="?", default=NEWS_PATH)
+    parser.add_argument("parquet_path", nargs="?", default=PARQUET_PATH)
+    parser.add_argument("--novos", action="store_true",
+                        help="só os ficheiros novos, acrescentados aos já convertidos")
+    args = parser.parse_args(sys.argv[1:])
+
+    spark = SparkSession.builder \
+        .appName("News Ingest") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+
+    if args.novos:
+        manifest = update(spark, args.news_path, args.parquet_path)
+        print("nothing new" if manifest is None else
+              f"generation {manifest['generation']}: {manifest['news']} news, last month {manifest['last_news']}")
+    else:
+        ingest(spark, args.news_path, args.parquet_path)
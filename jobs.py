@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# %% [markdown]
+# pesquisas em segundo plano (uma so execucao por topico)
+
+# %%
+
+class Cancelled(Exception):
+    # raised by on_progress to drop a job nobody is waiting for
+    pass
+
+class SearchJobs:
+    def __init__(self, max_workers, on_progress, on_done, on_error):
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, function):
+        # identical concurrent searches share the same in-flight job
+        with self._lock:
+            if key not in self._inflight:
+                self._inflight[key] = self._executor.submit(self._run, key, function)
+            return self._inflight[key]
+
+    def _run(self, key, function):
+        # the job stays in flight until on_done has published its result,
+        # so a concurrent submit never starts a duplicate
+        try:
+            result = function(lambda stage: self.on_progress(key, stage))
+            self.on_done(key, result)
+            return result
+        except Cancelled:
+            return None
+        except Exception as error:
+            self.on_error(key, error)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
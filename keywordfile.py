@@ -0,0 +1,161 @@
+from collections.abc import Mapping
+import json
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+# %% [markdown]
+# formato binario compacto para as palavras-chave de uma pesquisa
+#
+# magic | tamanho do cabecalho | cabecalho json | seccoes alinhadas a 8 bytes
+#
+# - count, sentiment: arrays colunares (um valor por palavra-chave)
+# - record_offsets + records: registo comprimido de cada palavra-chave
+#   (meses, fontes e ids dos urls), lido apenas quando e pedido
+# - url_offsets + urls: tabela de urls sem repeticoes, comprimida em blocos
+
+# %%
+
+MAGIC = b"LUPAKW1\n"
+URL_BLOCK_SIZE = 256
+
+def _pack_record(date, source, news, source_ids, url_ids):
+    months = np.fromiter((int(k) for k in date), dtype=np.int32, count=len(date))
+    month_counts = np.fromiter((int(v) for v in date.values()), dtype=np.int64, count=len(date))
+    sources = np.fromiter((source_ids[k] for k in source), dtype=np.int32, count=len(source))
+    source_counts = np.fromiter((int(v) for v in source.values()), dtype=np.int64, count=len(source))
+    urls = np.fromiter((url_ids[u] for u in news), dtype=np.int32, count=len(news))
+
+    raw = struct.pack("<III", len(months), len(sources), len(urls)) + b"".join(
+        array.tobytes() for array in (months, month_counts, sources, source_counts, urls))
+    return zlib.compress(raw)
+
+def _unpack_record(data):
+    raw = zlib.decompress(data)
+    n_months, n_sources, n_urls = struct.unpack_from("<III", raw)
+    position = 12
+    arrays = []
+    for dtype, length in ((np.int32, n_months), (np.int64, n_months),
+                          (np.int32, n_sources), (np.int64, n_sources),
+                          (np.int32, n_urls)):
+        arrays.append(np.frombuffer(raw, dtype=dtype, count=length, offset=position))
+        position += np.dtype(dtype).itemsize * length
+    return arrays
+
+def write_keywords(path, keywords):
+    # most mentioned first, so the top n keywords are the first n records
+    # (each record is read once, e.g. from a KeywordTable)
+    keywords = {key: keywords[key] for key in keywords}
+    keys = sorted(keywords, key=lambda k: keywords[k]["count"], reverse=True)
+
+    # interned sources and urls
+    sources, source_ids = [], {}
+    urls, url_ids = [], {}
+    for key in keys:
+        for source in keywords[key]["source"]:
+            if source not in source_ids:
+                source_ids[source] = len(sources)
+                sources.append(source)
+        for url in keywords[key]["news"]:
+            if url not in url_ids:
+                url_ids[url] = len(urls)
+                urls.append(url)
+
+    records = [_pack_record(keywords[k]["date"], keywords[k]["source"], keywords[k]["news"],
+                            source_ids, url_ids) for k in keys]
+    url_blocks = [zlib.compress("\n".join(urls[i:i+URL_BLOCK_SIZE]).encode())
+                  for i in range(0, len(urls), URL_BLOCK_SIZE)]
+
+    sections = {
+        "count": np.array([keywords[k]["count"] for k in keys], dtype=np.int64).tobytes(),
+        "sentiment": np.array([keywords[k]["sentiment"] for k in keys], dtype=np.float64).tobytes(),
+        "record_offsets": np.cumsum([0] + [len(r) for r in records], dtype=np.uint64).tobytes(),
+        "records": b"".join(records),
+        "url_offsets": np.cumsum([0] + [len(b) for b in url_blocks], dtype=np.uint64).tobytes(),
+        "urls": b"".join(url_blocks),
+    }
+
+    # section offsets are relative to the end of the header
+    layout, position = {}, 0
+    for name, data in sections.items():
+        layout[name] = [position, len(data)]
+        position += len(data) + (-len(data) % 8)
+
+    header = json.dumps({"keys": keys,
+                         "sources": sources,
+                         "url_block_size": URL_BLOCK_SIZE,
+                         "sections": layout}).encode()
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+        for data in sections.values():
+            file.write(data)
+            file.write(b"\0" * (-len(data) % 8))
+
+class KeywordFile(Mapping):
+    # read only, memory mapped view of a file written by write_keywords;
+    # a keyword's record is only decompressed when it is looked up
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a keyword file")
+        header_length, = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start:start+header_length])
+        self._base = start + header_length
+
+        self._keys = header["keys"]
+        self._positions = {key: i for i, key in enumerate(self._keys)}
+        self._sources = header["sources"]
+        self._url_block_size = header["url_block_size"]
+        self._sections = header["sections"]
+        self._url_blocks = {}
+
+        self.counts = self._array("count", np.int64)
+        self.sentiments = self._array("sentiment", np.float64)
+        self._record_offsets = self._array("record_offsets", np.uint64)
+        self._url_offsets = self._array("url_offsets", np.uint64)
+
+    def _array(self, name, dtype):
+        offset, length = self._sections[name]
+        return np.frombuffer(self._mmap, dtype=dtype, count=length // np.dtype(dtype).itemsize,
+                             offset=self._base + offset)
+
+    def _section_slice(self, name, start, end):
+        offset, _ = self._sections[name]
+        return self._mmap[self._base + offset + start:self._base + offset + end]
+
+    def _url(self, url_id):
+        block = url_id // self._url_block_size
+        if block not in self._url_blocks:
+            data = self._section_slice("urls", int(self._url_offsets[block]), int(self._url_offsets[block+1]))
+            self._url_blocks[block] = zlib.decompress(data).decode().split("\n")
+        return self._url_blocks[block][url_id % self._url_block_size]
+
+    def __getitem__(self, key):
+        i = self._positions[key]
+        data = self._section_slice("records", int(self._record_offsets[i]), int(self._record_offsets[i+1]))
+        months, month_counts, sources, source_counts, urls = _unpack_record(data)
+
+        return {"count": int(self.counts[i]),
+                "date": dict(zip(months.tolist(), month_counts.tolist())),
+                "sentiment": float(self.sentiments[i]),
+                "source": {self._sources[s]: c for s, c in zip(sources.tolist(), source_counts.tolist())},
+                "news": [self._url(u) for u in urls.tolist()]}
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
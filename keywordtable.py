@@ -0,0 +1,202 @@
+from collections.abc import Mapping
+import sys
+
+import numpy as np
+
+# %% [markdown]
+# palavras-chave de uma pesquisa em colunas (em vez de um dict por palavra)
+#
+# - counts, sentiments: um valor por palavra-chave
+# - meses e fontes de cada palavra-chave em formato CSR: a linha i vai de
+#   offsets[i] a offsets[i+1] nos arrays de valores
+# - news: ids de urls (CSR), numa lista de urls sem repeticoes
+#
+# quantis, top n, tamanhos e cores dos nodes sao operacoes NumPy sobre as
+# colunas; table[key] continua a dar o registo antigo (count, date,
+# sentiment, source, news) a quem o usa
+
+# %%
+
+def _csr(rows):
+    # offsets of a list of per-row lengths
+    return np.concatenate([[0], np.cumsum(rows, dtype=np.int64)]).astype(np.int64)
+
+def top_rows(counts, keys, n):
+    # rows of the n largest counts, ordered by count and then keyword: the
+    # same keywords are chosen whatever the row order, and the top n are
+    # the first n of any larger top
+    counts = np.asarray(counts)
+    if n >= len(counts):
+        rows = np.arange(len(counts))
+    else:
+        threshold = np.partition(counts, len(counts) - n)[len(counts) - n]
+        above = np.flatnonzero(counts > threshold)
+        tied = np.flatnonzero(counts == threshold)
+        tied = tied[np.argsort([keys[i] for i in tied], kind="stable")][:n - len(above)]
+        rows = np.concatenate([above, tied])
+    if len(rows) == 0:
+        return rows
+    return rows[np.lexsort((np.array([keys[i] for i in rows]), -counts[rows]))]
+
+class KeywordTable(Mapping):
+
+    def __init__(self, keys, counts, sentiments,
+                 month_offsets, months, month_counts,
+                 sources, source_offsets, source_ids, source_counts,
+                 urls, news_offsets, news_ids, margins=None):
+        self.keywords = list(keys)
+        self._positions = {key: i for i, key in enumerate(self.keywords)}
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.sentiments = np.asarray(sentiments, dtype=np.float64)
+        self.month_offsets, self.months, self.month_counts = month_offsets, months, month_counts
+        self.sources = sources
+        self.source_offsets, self.source_ids, self.source_counts = source_offsets, source_ids, source_counts
+        self.urls = urls
+        self.news_offsets, self.news_ids = news_offsets, news_ids
+
+        # relative error of each count, for approximate results
+        self.margins = None if margins is None else np.asarray(margins, dtype=np.float64)
+
+    @classmethod
+    def from_keywords(cls, keywords):
+        # from {keyword: {count, date, sentiment, source, news}} (a dict or a KeywordFile)
+        if isinstance(keywords, KeywordTable):
+            return keywords
+        keys = list(keywords)
+        records = [keywords[key] for key in keys]
+
+        sources, source_index = [], {}
+        urls, url_index = [], {}
+        for record in records:
+            for source in record["source"]:
+                if source not in source_index:
+                    source_index[source] = len(sources)
+                    sources.append(source)
+            for url in record["news"]:
+                if url not in url_index:
+                    url_index[url] = len(urls)
+                    urls.append(url)
+
+        # (source counts can be missing for a source, they are left out)
+        source_items = [[(source, count) for source, count in record["source"].items() if count is not None]
+                        for record in records]
+        return cls(
+            keys,
+            [record["count"] for record in records],
+            [record["sentiment"] for record in records],
+            _csr([len(record["date"]) for record in records]),
+            np.array([int(month) for record in records for month in record["date"]], dtype=np.int64),
+            np.array([int(count) for record in records for count in record["date"].values()], dtype=np.int64),
+            sources,
+            _csr([len(items) for items in source_items]),
+            np.array([source_index[source] for items in source_items for source, _ in items], dtype=np.int64),
+            np.array([int(count) for items in source_items for _, count in items], dtype=np.int64),
+            urls,
+            _csr([len(record["news"]) for record in records]),
+            np.array([url_index[url] for record in records for url in record["news"]], dtype=np.int64),
+            [record["margin"] for record in records] if records and "margin" in records[0] else None)
+
+    @classmethod
+    def columns(cls, keys, counts, sentiments):
+        # only counts and sentiments (keywords without months, sources or news)
+        empty, offsets = np.zeros(0, dtype=np.int64), np.zeros(len(keys) + 1, dtype=np.int64)
+        return cls(keys, counts, sentiments, offsets, empty, empty, [], offsets, empty, empty, [], offsets, empty)
+
+    # rows
+
+    def row(self, key):
+        return self._positions[key]
+
+    def take(self, rows):
+        # a table with only these rows, in this order (urls and sources are shared)
+        rows = np.asarray(rows, dtype=np.int64)
+
+        def gather(offsets, *values):
+            lengths = offsets[rows + 1] - offsets[rows]
+            starts = np.repeat(offsets[rows] - _csr(lengths)[:-1], lengths)
+            positions = starts + np.arange(lengths.sum())
+            return (_csr(lengths), *(value[positions] for value in values))
+
+        return KeywordTable([self.keywords[i] for i in rows], self.counts[rows], self.sentiments[rows],
+                            *gather(self.month_offsets, self.months, self.month_counts),
+                            self.sources, *gather(self.source_offsets, self.source_ids, self.source_counts),
+                            self.urls, *gather(self.news_offsets, self.news_ids),
+                            None if self.margins is None else self.margins[rows])
+
+    def without(self, key):
+        # the table without one keyword (e.g. the query itself)
+        if key not in self._positions:
+            return self
+        return self.take(np.delete(np.arange(len(self)), self._positions[key]))
+
+    def top(self, n):
+        # rows of the n most mentioned keywords, most mentioned first
+        return top_rows(self.counts, self.keywords, n)
+
+    # columns
+
+    def news_stamps(self):
+        # yyyymm of every url (the arquivo.pt timestamp)
+        if not hasattr(self, "_news_stamps"):
+            self._news_stamps = np.array([int(url.split("/")[5][:6]) for url in self.urls], dtype=np.int64)
+        return self._news_stamps
+
+    def news_range(self):
+        # (first, last) yyyymm of each keyword's news
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        stamps = self.news_stamps()[self.news_ids]
+        starts = self.news_offsets[:-1]
+        return np.minimum.reduceat(stamps, starts), np.maximum.reduceat(stamps, starts)
+
+    # one keyword
+
+    def dates(self, key):
+        # (months, mentions) of a keyword
+        i = self._positions[key]
+        start, end = self.month_offsets[i], self.month_offsets[i+1]
+        return self.months[start:end], self.month_counts[start:end]
+
+    def source_counts_of(self, key):
+        # {source: news} of a keyword
+        i = self._positions[key]
+        start, end = self.source_offsets[i], self.source_offsets[i+1]
+        return {self.sources[s]: c for s, c in zip(self.source_ids[start:end].tolist(),
+                                                   self.source_counts[start:end].tolist())}
+
+    def news(self, key):
+        # urls of a keyword's news
+        i = self._positions[key]
+        return [self.urls[u] for u in self.news_ids[self.news_offsets[i]:self.news_offsets[i+1]].tolist()]
+
+    # mapping of the old records
+
+    def __getitem__(self, key):
+        i = self._positions[key]
+        months, mentions = self.dates(key)
+        record = {"count": int(self.counts[i]),
+                  "date": dict(zip(months.tolist(), mentions.tolist())),
+                  "sentiment": float(self.sentiments[i]),
+                  "source": self.source_counts_of(key),
+                  "news": self.news(key)}
+        if self.margins is not None:
+            record["margin"] = float(self.margins[i])
+        return record
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __iter__(self):
+        return iter(self.keywords)
+
+    def __len__(self):
+        return len(self.keywords)
+
+    @property
+    def nbytes(self):
+        # resident size, for the result store's budget
+        arrays = (self.counts, self.sentiments, self.month_offsets, self.months, self.month_counts,
+                  self.source_offsets, self.source_ids, self.source_counts, self.news_offsets, self.news_ids)
+        strings = (self.keywords, self.sources, self.urls)
+        return (sum(array.nbytes for array in arrays)
+                + sum(sys.getsizeof(value) for values in strings for value in values))
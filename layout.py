@@ -0,0 +1,198 @@
+import hashlib
+
+import numpy as np
+
+# %% [markdown]
+# disposicao dos nos do grafo: forcas de repulsao (Fruchterman-Reingold,
+# como o nx.spring_layout sem arestas) vetorizadas em NumPy
+#
+# - a semente vem da pesquisa, o mesmo topico tem sempre o mesmo grafo
+# - a repulsao entre nos distantes e aproximada por celulas de uma grelha
+#   (a massa de cada celula no seu centro, somada por FFT), so os vizinhos
+#   sao exatos
+# - nos com posicao conhecida (de um grafo anterior) ficam fixos
+# - expand_layout junta nos a um grafo ja desenhado: so os novos se movem,
+#   e cada iteracao custa o numero de nos novos (os fixos sao postos na
+#   grelha uma vez, e a grelha tem um tamanho maximo)
+
+# %%
+
+# 15 steps of the cooling schedule (nx.spring_layout does 50): nodes end as
+# evenly spread, in a smaller box, which the plot rescales anyway
+ITERATIONS = 15
+
+def query_seed(query):
+    return int(hashlib.sha256(query.encode()).hexdigest()[:16], 16)
+
+def initial_positions(count, rng, spread_x=300, spread_y=150, min_distance=50):
+    # uniform in the box, away from the center (the query's node)
+    pos = np.empty((count, 2))
+    todo = np.arange(count)
+    while len(todo) > 0:
+        pos[todo] = rng.uniform((-spread_x, -spread_y), (spread_x, spread_y), (len(todo), 2))
+        todo = todo[np.hypot(pos[todo, 0], pos[todo, 1]) < min_distance]
+    return pos
+
+def _cell_index(cells, grid):
+    # nodes sorted by cell, with each cell's range in that order
+    order = np.argsort(cells, kind="stable")
+    starts = np.searchsorted(cells[order], np.arange(grid * grid))
+    ends = np.searchsorted(cells[order], np.arange(grid * grid), side="right")
+    return order, starts, ends
+
+def _neighbour_pairs(cells, index, grid):
+    # (i, j) pairs of a node i (of cells) and an indexed node j in the
+    # same or an adjacent grid cell
+    order, starts, ends = index
+    cx, cy = cells // grid, cells % grid
+    pairs_i, pairs_j = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            ncx, ncy = cx + dx, cy + dy
+            valid = (ncx >= 0) & (ncx < grid) & (ncy >= 0) & (ncy < grid)
+            i = np.flatnonzero(valid)
+            neighbour = ncx[i] * grid + ncy[i]
+            lengths = ends[neighbour] - starts[neighbour]
+            pairs_i.append(np.repeat(i, lengths))
+            offsets = np.repeat(starts[neighbour] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+            pairs_j.append(order[offsets + np.arange(lengths.sum())])
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+def _pairs(cells, grid):
+    # (i, j) node pairs in the same or adjacent grid cells
+    i, j = _neighbour_pairs(cells, _cell_index(cells, grid), grid)
+    keep = i != j
+    return i[keep], j[keep]
+
+def _near_force(delta, k):
+    return delta * (k * k / np.maximum(delta[:, 0] ** 2 + delta[:, 1] ** 2, 1e-4))[:, None]
+
+def far_kernel(grid, width, k):
+    # force on a unit mass from a unit mass dx, dy cells away (both at their
+    # cells' centers), 0 between neighbouring cells (exact near field)
+    d = np.arange(-(grid - 1), grid)
+    dx, dy = np.meshgrid(d * width[0], d * width[1], indexing="ij")
+    weight = k * k / np.maximum(dx ** 2 + dy ** 2, 1e-4)
+    weight[(np.abs(d)[:, None] <= 1) & (np.abs(d)[None, :] <= 1)] = 0
+    return dx * weight, dy * weight
+
+def repulsion(pos, k, grid):
+    # sum over the other nodes of (pi - pj) * k^2 / |pi - pj|^2
+    low, high = pos.min(axis=0), pos.max(axis=0)
+    scaled = (pos - low) / np.maximum(high - low, 1e-9) * (grid - 1e-9)
+    cx, cy = scaled[:, 0].astype(int), scaled[:, 1].astype(int)
+    cells = cx * grid + cy
+
+    # near field: exact, between nodes of neighbouring cells (each pair
+    # once, pushing both nodes)
+    i, j = _pairs(cells, grid)
+    once = i < j
+    i, j = i[once], j[once]
+    force = _near_force(pos[i] - pos[j], k)
+    displacement = np.stack([np.bincount(i, force[:, axis], minlength=len(pos))
+                             - np.bincount(j, force[:, axis], minlength=len(pos)) for axis in (0, 1)], axis=1)
+
+    # far field: the cell masses convolved with the cell to cell force
+    # (an FFT, instead of every pair of occupied cells), each node gets its
+    # cell's share
+    mass = np.bincount(cells, minlength=grid * grid).astype(float).reshape(grid, grid)
+    size = (3 * grid - 2, 3 * grid - 2)
+    mass_hat = np.fft.rfft2(mass, size)
+    cell_force = np.stack([np.fft.irfft2(mass_hat * np.fft.rfft2(kernel, size), size)[grid-1:2*grid-1, grid-1:2*grid-1]
+                           for kernel in far_kernel(grid, np.maximum(high - low, 1e-9) / grid, k)], axis=-1)
+    return displacement + cell_force.reshape(grid * grid, 2)[cells]
+
+def force_layout(nodes, query, fixed=None, k=0.1, iterations=ITERATIONS, threshold=1e-4):
+    # {node: (x, y)}, the query's node at the origin; nodes already in fixed keep their place
+    fixed = fixed or {}
+    nodes = sorted(nodes)
+    rng = np.random.default_rng(query_seed(query))
+
+    pos = np.zeros((len(nodes) + 1, 2))
+    pos[1:] = initial_positions(len(nodes), rng)
+    pinned = np.zeros(len(nodes) + 1, dtype=bool)
+    pinned[0] = True
+    for index, node in enumerate(nodes, start=1):
+        if node in fixed:
+            pos[index] = fixed[node]
+            pinned[index] = True
+
+    # cooling schedule of nx.spring_layout: each node moves by the
+    # temperature, in the direction of its net force
+    grid = max(1, int(np.sqrt(len(pos) / 4)))
+    temperature = 0.1 * max(np.ptp(pos[:, 0]), np.ptp(pos[:, 1]))
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        if pinned.all():
+            break
+        displacement = repulsion(pos, k, grid)
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 0.01)
+        step = displacement * (temperature / length)[:, None]
+        step[pinned] = 0
+        pos += step
+        temperature -= cooling
+        if np.linalg.norm(step) / len(pos) < threshold:
+            break
+
+    return {node: (float(x), float(y)) for node, (x, y) in zip(nodes, pos[1:])}
+
+def expand_layout(fixed, nodes, query, k=0.1, iterations=50, threshold=1e-4, max_grid=16):
+    # {node: (x, y)} for the nodes not in fixed, placed around the fixed ones
+    # (and the query's node at the origin), which do not move
+    nodes = sorted(node for node in nodes if node not in fixed)
+    if not nodes:
+        return {}
+    fixed_pos = np.array([(0.0, 0.0)] + [tuple(xy) for xy in fixed.values()])
+    rng = np.random.default_rng(query_seed(f"{query} +{len(fixed)}"))
+    spread = np.maximum(np.abs(fixed_pos).max(axis=0), (300, 150))
+    pos = initial_positions(len(nodes), rng, *spread)
+
+    # grid over the graph's box
+    grid = min(max(1, int(np.sqrt((len(fixed_pos) + len(nodes)) / 4))), max_grid)
+    low, high = -spread, spread
+
+    def cells_of(points):
+        scaled = np.minimum((points - low) / (high - low) * grid, grid - 1e-9).astype(int)
+        return scaled[:, 0] * grid + scaled[:, 1]
+
+    fixed_cells = cells_of(fixed_pos)
+    fixed_index = _cell_index(fixed_cells, grid)
+    fixed_mass = np.bincount(fixed_cells, minlength=grid * grid).astype(float)
+    fixed_sums = np.stack([np.bincount(fixed_cells, fixed_pos[:, axis], minlength=grid * grid)
+                           for axis in (0, 1)], axis=1)
+
+    temperature = 0.1 * max(np.ptp(pos[:, 0]), np.ptp(pos[:, 1]))
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        cells = cells_of(pos)
+
+        # near field: exact, from the fixed and new nodes of neighbouring cells
+        i, j = _neighbour_pairs(cells, fixed_index, grid)
+        force = _near_force(pos[i] - fixed_pos[j], k)
+        displacement = np.stack([np.bincount(i, force[:, axis], minlength=len(pos)) for axis in (0, 1)], axis=1)
+        i, j = _pairs(cells, grid)
+        force = _near_force(pos[i] - pos[j], k)
+        displacement += np.stack([np.bincount(i, force[:, axis], minlength=len(pos)) for axis in (0, 1)], axis=1)
+
+        # far field: every other occupied cell, its mass at its center
+        mass = fixed_mass + np.bincount(cells, minlength=grid * grid)
+        centers = fixed_sums + np.stack([np.bincount(cells, pos[:, axis], minlength=grid * grid)
+                                         for axis in (0, 1)], axis=1)
+        occupied = np.flatnonzero(mass)
+        centers = centers[occupied] / mass[occupied][:, None]
+        ox, oy = occupied // grid, occupied % grid
+        far = ((np.abs((cells // grid)[:, None] - ox[None, :]) > 1)
+               | (np.abs((cells % grid)[:, None] - oy[None, :]) > 1))
+        delta = pos[:, None, :] - centers[None, :, :]
+        weight = np.where(far, mass[occupied][None, :] * k * k / np.maximum((delta ** 2).sum(axis=2), 1e-4), 0)
+        displacement += (delta * weight[:, :, None]).sum(axis=1)
+
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 0.01)
+        step = displacement * (temperature / length)[:, None]
+        # (nothing pulls nodes in: they stay inside the graph's box)
+        pos = np.clip(pos + step, low, high)
+        temperature -= cooling
+        if np.linalg.norm(step) / len(pos) < threshold:
+            break
+
+    return {node: (float(x), float(y)) for node, (x, y) in zip(nodes, pos)}
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+
+# %% [markdown]
+# manifesto da conversao para parquet: ficheiros json ja convertidos,
+# estatisticas do corpus e atualizacoes incrementais
+#
+#     {"dataset": id da conversao completa (muda so quando tudo e refeito),
+#      "generation": numero de atualizacoes incrementais,
+#      "files": {caminho relativo: [tamanho, mtime_ns]},
+#      "news": numero de noticias, "last_news": ultimo mes,
+#      "next_row_id": primeiro row id livre}
+#
+# as palavras-chave tocadas por cada atualizacao ficam em
+# updates/<generation>.json, para invalidar so as pesquisas afetadas
+
+# %%
+
+MANIFEST = "manifest.json"
+
+def source_files(news_path):
+    # every json file of the crawl, with its size and modification time
+    files = {}
+    for root, _, names in os.walk(news_path):
+        for name in names:
+            if name.startswith((".", "_")):
+                continue
+            stat = os.stat(os.path.join(root, name))
+            files[os.path.relpath(os.path.join(root, name), news_path)] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+def read_manifest(parquet_path):
+    # None for conversions made before the manifest existed
+    try:
+        with open(f"{parquet_path}/{MANIFEST}", "r") as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+
+def _write_json(path, value):
+    # readers only ever see complete files
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as json_file:
+        json.dump(value, json_file)
+    os.replace(tmp_path, path)
+
+def write_manifest(parquet_path, manifest):
+    _write_json(f"{parquet_path}/{MANIFEST}", manifest)
+
+def write_update(parquet_path, generation, keywords):
+    os.makedirs(f"{parquet_path}/updates", exist_ok=True)
+    _write_json(f"{parquet_path}/updates/{generation}.json", sorted(keywords))
+
+def updated_keywords(parquet_path, since, until):
+    # keywords whose results changed after generation `since`, up to `until`
+    keywords = set()
+    for generation in range(since + 1, until + 1):
+        with open(f"{parquet_path}/updates/{generation}.json", "r") as json_file:
+            keywords.update(json.load(json_file))
+    return keywords
@@ -0,0 +1,5 @@
+# Data locations, shared by the offline jobs and the app
+
+NEWS_PATH = "../data/news/status=success"
+PARQUET_PATH = "../data/parquet"
+COOCCURRENCE_PATH = "../data/cooccurrence"
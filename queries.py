@@ -0,0 +1,251 @@
+import re
+
+import numpy as np
+
+# %% [markdown]
+# pesquisas com varios topicos: expressoes booleanas sobre palavras-chave
+#
+#     Lisboa AND Porto
+#     (Lisboa OR Porto) AND NOT Benfica
+#     Lisboa OU Porto, NÃO Benfica        (a virgula e um AND)
+#
+# uma palavra-chave do corpus que pareca uma expressao ("Banco de
+# Portugal, SA", "Ciência E Tecnologia") e procurada como palavra-chave
+#
+# cada topico e uma lista ordenada de row ids (o indice invertido), e a
+# expressao e avaliada com intersecoes/unioes/diferencas dessas listas
+#
+# uma pesquisa pode ainda ter uma janela temporal (meses yyyymm), que faz
+# parte da sua chave: "Lisboa [2019-01..2019-12]"
+
+# %%
+
+OPERATORS = {"AND": "and", "E": "and", "OR": "or", "OU": "or",
+             "NOT": "not", "NÃO": "not", "NAO": "not"}
+
+WINDOW = re.compile(r"^(.*) \[(\d{4}-\d{2})?\.\.(\d{4}-\d{2})?\]$")
+
+TOKENS = re.compile(r'"([^"]*)"|([(),])|([^\s(),"]+)')
+
+def tokenize(text):
+    # operators (upper case words), parentheses, commas and keywords, with
+    # consecutive plain words joined into one keyword ("Rebelo de Sousa")
+    tokens, words = [], []
+    for match in TOKENS.finditer(text):
+        quoted, symbol, word = match.groups()
+        if word is not None and word not in OPERATORS:
+            words.append(word)
+            continue
+        if words:
+            tokens.append(("term", " ".join(words)))
+            words = []
+        if quoted is not None:
+            tokens.append(("term", " ".join(quoted.split())))
+        elif symbol:
+            tokens.append((symbol, symbol))
+        else:
+            tokens.append((OPERATORS[word], word))
+    if words:
+        tokens.append(("term", " ".join(words)))
+    return tokens
+
+def parse(text):
+    # a keyword (str) or a tree of ("and" | "or" | "not", operands...)
+    tokens = tokenize(text)
+    position = 0
+
+    def peek():
+        return tokens[position][0] if position < len(tokens) else None
+
+    def take(kind):
+        nonlocal position
+        if peek() != kind:
+            raise ValueError(f"expected {kind} in {text!r}")
+        position += 1
+        return tokens[position-1][1]
+
+    def node(operator, operands):
+        # flat: (A AND B) AND C is A AND B AND C
+        flat = []
+        for operand in operands:
+            flat.extend(operand[1:] if isinstance(operand, tuple) and operand[0] == operator else [operand])
+        return flat[0] if len(flat) == 1 else (operator, *flat)
+
+    def clauses():
+        operands = [disjunction()]
+        while peek() == ",":
+            take(",")
+            operands.append(disjunction())
+        return node("and", operands)
+
+    def disjunction():
+        operands = [conjunction()]
+        while peek() == "or":
+            take("or")
+            operands.append(conjunction())
+        return node("or", operands)
+
+    def conjunction():
+        operands = [unary()]
+        while peek() == "and":
+            take("and")
+            operands.append(unary())
+        return node("and", operands)
+
+    def unary():
+        if peek() == "not":
+            take("not")
+            return ("not", unary())
+        if peek() == "(":
+            take("(")
+            inner = clauses()
+            take(")")
+            return inner
+        return take("term")
+
+    tree = clauses()
+    if position != len(tokens):
+        raise ValueError(f"unexpected {tokens[position][1]!r} in {text!r}")
+    check(tree)
+    return tree
+
+def check(tree, negated_ok=False):
+    # NOT only restricts other topics: "A AND NOT B", never a bare "NOT B"
+    if isinstance(tree, str):
+        return
+    operator, *operands = tree
+    if operator == "not":
+        if not negated_ok:
+            raise ValueError("NOT needs a topic to restrict")
+        check(operands[0])
+        return
+    if operator == "and" and all(is_negation(operand) for operand in operands):
+        raise ValueError("NOT needs a topic to restrict")
+    for operand in operands:
+        check(operand, negated_ok=operator == "and")
+
+def is_negation(tree):
+    return isinstance(tree, tuple) and tree[0] == "not"
+
+def resolve(tree, canonical):
+    # replace every keyword by its corpus spelling (if it has one)
+    if isinstance(tree, str):
+        return canonical(tree) or tree
+    return (tree[0], *(resolve(operand, canonical) for operand in tree[1:]))
+
+def to_text(tree, parent=None):
+    # canonical text of a query (the key of its cached result)
+    if isinstance(tree, str):
+        if not tree or set(tree.split()) & set(OPERATORS) or set(tree) & set('(),'):
+            return f'"{tree}"'
+        return tree
+    operator, *operands = tree
+    if operator == "not":
+        return f"NOT {to_text(operands[0], 'not')}"
+    text = f" {operator.upper()} ".join(to_text(operand, operator) for operand in operands)
+    return f"({text})" if parent is not None else text
+
+def as_keywords(query):
+    # a keyword, or the keywords of a multi-topic query
+    return [query] if isinstance(query, str) else list(query)
+
+def positive_terms(tree):
+    # keywords the matched news are about (not the excluded ones)
+    if isinstance(tree, str):
+        return [tree]
+    if tree[0] == "not":
+        return []
+    terms = []
+    for operand in tree[1:]:
+        terms.extend(term for term in positive_terms(operand) if term not in terms)
+    return terms
+
+def can_match(tree, known):
+    # False if no news can match: a topic an AND needs, or every topic of
+    # an OR, is not known (excluded topics never empty a search)
+    if isinstance(tree, str):
+        return known(tree)
+    operator, *operands = tree
+    if operator == "and":
+        return all(can_match(operand, known) for operand in operands if not is_negation(operand))
+    return any(can_match(operand, known) for operand in operands)
+
+def parse_month(text, last=False):
+    # "2019", "2019-05" or "201905" as yyyymm (a year is its first or last month)
+    digits = text.replace("-", "").strip()
+    if not digits.isdigit() or len(digits) not in (4, 6):
+        raise ValueError(f"invalid month: {text!r}")
+    if len(digits) == 4:
+        digits += "12" if last else "01"
+    if not 1 <= int(digits[4:]) <= 12:
+        raise ValueError(f"invalid month: {text!r}")
+    return int(digits)
+
+def parse_window(start=None, end=None):
+    # (first month, last month), either open; None for the whole archive
+    window = (parse_month(start) if start else None, parse_month(end, last=True) if end else None)
+    if None not in window and window[0] > window[1]:
+        raise ValueError(f"window ends before it starts: {start!r}..{end!r}")
+    return None if window == (None, None) else window
+
+def with_window(query, window):
+    # search key of a query restricted to a window
+    if window is None:
+        return query
+    start, end = (f"{month // 100}-{month % 100:02d}" if month else "" for month in window)
+    return f"{query} [{start}..{end}]"
+
+def split_window(key):
+    # (query, window) of a search key
+    match = WINDOW.match(key)
+    if match is None:
+        return key, None
+    query, start, end = match.groups()
+    try:
+        return query, parse_window(start, end)
+    except ValueError:
+        # typed as part of the topic, not a window of ours
+        return key, None
+
+def in_window(months, window):
+    # boolean mask of the months inside the window
+    months = np.asarray(months)
+    mask = np.ones(len(months), dtype=bool)
+    if window is not None and window[0] is not None:
+        mask &= months >= window[0]
+    if window is not None and window[1] is not None:
+        mask &= months <= window[1]
+    return mask
+
+def keywords_of(key, is_keyword=lambda query: False):
+    # keywords whose news make up a search's results (a query that is a
+    # keyword as a whole is not read as an expression)
+    query, _ = split_window(key)
+    if is_keyword(query):
+        return [query]
+    try:
+        return positive_terms(parse(query))
+    except ValueError:
+        return [query]
+
+def evaluate(tree, lookup):
+    # sorted row ids of the news matching the query
+    if isinstance(tree, str):
+        return np.asarray(lookup(tree), dtype=np.int64)
+    operator, *operands = tree
+
+    if operator == "or":
+        row_ids = evaluate(operands[0], lookup)
+        for operand in operands[1:]:
+            row_ids = np.union1d(row_ids, evaluate(operand, lookup))
+        return row_ids
+
+    # and: intersect the positive lists (smallest first), then subtract the negated ones
+    positive = sorted((evaluate(operand, lookup) for operand in operands if not is_negation(operand)), key=len)
+    row_ids = positive[0]
+    for other in positive[1:]:
+        row_ids = np.intersect1d(row_ids, other, assume_unique=True)
+    for operand in operands:
+        if is_negation(operand) and len(row_ids) > 0:
+            row_ids = np.setdiff1d(row_ids, evaluate(operand[1], lookup), assume_unique=True)
+    return row_ids
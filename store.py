@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import threading
+import sys
+
+import pandas as pd
+
+# %% [markdown]
+# resultados das pesquisas partilhados entre sessoes
+
+# %%
+
+def normalize_query(query):
+    # "  Lisboa " and "Lisboa" are the same search
+    return " ".join(query.split())
+
+def result_size(value):
+    # rough resident size of a search result, in bytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(result_size(k) + result_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(result_size(v) for v in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if hasattr(value, "nbytes"):
+        # numpy arrays and KeywordTable
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+class ResultStore:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key][0]
+
+    def put(self, key, result):
+        size = result_size(result)
+        with self._lock:
+            if key in self._results:
+                self.size -= self._results.pop(key)[1]
+            self._results[key] = (result, size)
+            self.size += size
+
+            # least recently used first, but never the result just stored
+            while self.size > self.max_bytes and len(self._results) > 1:
+                _, (_, evicted_size) = self._results.popitem(last=False)
+                self.size -= evicted_size
+
+    def discard_if(self, predicate):
+        # drop every result whose key matches, e.g. after new articles arrive
+        with self._lock:
+            for key in [key for key in self._results if predicate(key)]:
+                self.size -= self._results.pop(key)[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._results
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
@@ -0,0 +1,63 @@
+from bisect import bisect_left
+import unicodedata
+
+import numpy as np
+
+# %% [markdown]
+# indice de prefixos do vocabulario (palavras-chave com >= 5 mencoes numa
+# noticia), para sugestoes e para encontrar a palavra-chave de uma pesquisa
+#
+# as chaves sao normalizadas (minusculas, sem acentos, espacos colapsados):
+# "LISBOA", " lisboa" e "Lisboa" sao a mesma pesquisa
+
+# %%
+
+def fold(text):
+    # case, accent and whitespace insensitive key
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().split())
+
+class Vocabulary:
+    # sorted folded keys: every prefix is a contiguous range (a flattened trie)
+
+    def __init__(self, keywords, doc_freq):
+        # the most common spelling of each folded key is its canonical keyword
+        best = {}
+        for keyword, count in zip(keywords, doc_freq):
+            if count <= 0:
+                continue
+            key = fold(keyword)
+            if key not in best or count > best[key][1]:
+                best[key] = (keyword, int(count))
+
+        self.keys = sorted(best)
+        self.keywords = [best[key][0] for key in self.keys]
+        self.counts = np.array([best[key][1] for key in self.keys], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _range(self, prefix):
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + "\U0010ffff", start)
+        return start, end
+
+    def canonical(self, query):
+        # corpus keyword of a query, None if it matches no news
+        key = fold(query)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.keywords[i]
+        return None
+
+    def suggest(self, prefix, n=10):
+        # most common keywords starting with the prefix, with their news counts
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        start, end = self._range(prefix)
+        counts = self.counts[start:end]
+        best = np.argpartition(-counts, n)[:n] if len(counts) > n else np.arange(len(counts))
+        best = best[np.argsort(-counts[best], kind="stable")]
+        return [(self.keywords[start+i], int(counts[i])) for i in best]